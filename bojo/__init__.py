@@ -0,0 +1,4 @@
+import time
+
+# Used by `--trace` to report how long imports took.
+START_TIME = time.perf_counter()
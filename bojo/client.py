@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""The `bojo` entry point.
+
+If `bojo daemon` is running, commands are sent to it over its Unix socket,
+which skips importing and setting up everything in this process. Otherwise,
+or if the daemon can't run a command, it runs here as usual. This module
+should only import from the standard library, since it runs on every call.
+"""
+
+import json
+import os
+import socket
+import sys
+from typing import Any, Dict, List, Optional
+
+from bojo.config import get_daemon_socket, should_use_daemon
+
+
+def run_in_process() -> None:
+    from bojo.command_line import cli
+
+    cli()
+
+
+def send_request(argv: List[str]) -> Optional[int]:
+    """Runs a command in the daemon; returns its exit code, or None to fall back."""
+
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(str(get_daemon_socket()))
+    except OSError:
+        return None
+
+    request: Dict[str, Any] = {
+        'argv': argv,
+        'cwd': os.getcwd(),
+        'env': dict(os.environ),
+        'isatty': [sys.stdout.isatty(), sys.stderr.isatty()],
+    }
+    streams = {'out': sys.stdout, 'err': sys.stderr}
+    wrote_output = False
+    with sock, sock.makefile('rwb') as f:
+        f.write(json.dumps(request).encode('utf-8') + b'\n')
+        f.flush()
+        for line in f:
+            message = json.loads(line)
+            if 'fallback' in message:
+                return None
+            if 'exit' in message:
+                return message['exit']
+            stream = streams[message['stream']]
+            stream.write(message['text'])
+            stream.flush()
+            wrote_output = True
+    # The daemon went away; only rerun the command if it hadn't started.
+    return 1 if wrote_output else None
+
+
+def main() -> None:
+    if '_BOJO_COMPLETE' in os.environ:
+        from bojo.completion import fast_complete
+
+        if fast_complete():
+            return
+        run_in_process()
+        return
+
+    argv = sys.argv[1:]
+    if should_use_daemon():
+        exit_code = send_request(argv)
+        if exit_code is not None:
+            sys.exit(exit_code)
+    run_in_process()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,69 @@
 #!/usr/bin/env python
 
+import contextlib
+import itertools
 import json
+import mmap
+import os
 import sys
-from datetime import datetime
-from typing import List, Optional
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
 
 import click
-import dateparser
 import sqlalchemy as sql
+from click.shell_completion import CompletionItem
+from termcolor import colored
 
-from bojo.config import should_use_verbose
+import bojo
+from bojo.completion import choice_completions, id_completions, refresh_cache
+from bojo.config import get_trace_format, should_use_trace, should_use_verbose
 from bojo.db import (
+    archive_items,
+    bulk_load,
+    changed_since,
+    deleted_since,
+    get_archive_path,
+    get_current_time,
+    get_exception,
+    fetch_records,
     get_session,
+    ids_in_ranges,
+    import_items,
+    insert_rows,
+    migrate_items,
+    next_item_id,
+    search_items,
+    search_rank,
+    select_records,
+    update_items,
+    DATE_FORMAT,
     Item,
+    ItemTable,
     ItemState,
     ItemStateDict,
     ItemSignifier,
     ItemSignifierDict,
 )
+from bojo.profiling import enable_tracing, get_tracer
+from bojo.recurrence import iter_occurrences, parse_recurrence
 from bojo.render_utils import (
+    parse_batch_line,
     parse_choice,
+    parse_id_ranges,
     parse_state,
     parse_signifier,
+    parse_timestamp,
     render_items,
     render_title,
     NONE_STR,
 )
-from bojo.subcommands.list import list_command
+from bojo.subcommands.bench import bench_command
+from bojo.subcommands.daemon import daemon_command
+from bojo.subcommands.db import db_command
+from bojo.subcommands.list import list_command, overdue_query
 from bojo.subcommands.serve import serve_command
+from bojo.timeparse import parse_phrase
 
 if should_use_verbose():
     STATE_OPTS = ', '.join(
@@ -42,13 +78,71 @@ else:
     SIGNIFIER_PROMPT = 'Signifier'
 
 
+def profile_startup(ctx: click.Context, param: click.Parameter, value: bool) -> None:
+    if not value or ctx.resilient_parsing:
+        return
+
+    from bojo.profiling import profile_imports
+
+    timings = profile_imports()
+    total = sum(t.cumulative_time for t in timings if t.depth == 0)
+    render_title('Slowest imports')
+    slowest = sorted(timings, key=lambda t: t.cumulative_time, reverse=True)
+    for timing in slowest[:20]:
+        click.echo(f'{timing.cumulative_time * 1000:8.1f} ms  '
+                   f'{timing.self_time * 1000:8.1f} ms  {timing.module}')
+    click.echo(f'Total import time: {total * 1000:.1f} ms')
+    ctx.exit()
+
+
+def complete_ids(ctx: click.Context, param: click.Parameter,
+                 incomplete: str) -> List[CompletionItem]:
+    return [CompletionItem(value, help=help) for value, help in id_completions(incomplete)]
+
+
+def complete_choices(ctx: click.Context, param: click.Parameter,
+                     incomplete: str) -> List[CompletionItem]:
+    return [CompletionItem(value) for value, _ in choice_completions(incomplete)]
+
+
+def print_trace() -> None:
+    summary = get_tracer().summary()
+    if get_trace_format() == 'json':
+        click.echo(json.dumps(summary), err=True)
+        return
+
+    click.echo(colored('Trace', attrs=['underline']) + ':', err=True)
+    click.echo(f'  total    {summary["total_ms"]:8.1f} ms', err=True)
+    click.echo(f'  sql      {summary["sql_ms"]:8.1f} ms  '
+               f'{summary["statements"]} statements', err=True)
+    for name, phase in summary['phases'].items():
+        click.echo(f'  {name:8} {phase["ms"]:8.1f} ms  '
+                   f'{phase["statements"]} statements', err=True)
+    for statement in summary['slowest']:
+        click.echo(f'  {statement["ms"]:8.1f} ms  {statement["sql"][:100]}', err=True)
+
+
 @click.group()
-def cli():
+@click.option('--profile-startup', is_flag=True, is_eager=True, expose_value=False,
+              callback=profile_startup, help='Show per-import startup timings and exit')
+@click.option('--trace', is_flag=True,
+              help='Print timings and SQL counters to stderr (also set by BOJO_TRACE)')
+@click.pass_context
+def cli(ctx: click.Context, trace: bool):
     """A command-line bullet journal."""
 
-    pass
+    # Keeps the completion cache in step with any writes this command makes.
+    ctx.call_on_close(refresh_cache)
+
+    if trace or should_use_trace():
+        tracer = enable_tracing(bojo.START_TIME)
+        tracer.add_phase_time('imports', time.perf_counter() - bojo.START_TIME)
+        ctx.call_on_close(print_trace)
 
 
+cli.add_command(bench_command)
+cli.add_command(daemon_command)
+cli.add_command(db_command)
 cli.add_command(list_command)
 cli.add_command(serve_command)
 
@@ -59,7 +153,7 @@ def info() -> None:
 
 
 @cli.command(help='Delete an item forever')
-@click.argument('id', type=int)
+@click.argument('id', type=int, shell_complete=complete_ids)
 def delete(id: int) -> None:
     session = get_session()
     item = session.query(Item).get(id)
@@ -73,115 +167,454 @@ def delete(id: int) -> None:
         click.echo('Deleted item')
 
 
-@cli.command(help='Update item state')
-@click.argument('state', type=str)
-@click.argument('id', type=int)
-def mark(state: str, id: int) -> None:
+def parse_where(where: str) -> sql.sql.ColumnElement:
+    """Parses a `--where` filter like `state=incomplete` or `signifier=none`."""
+
+    key, _, value = where.partition('=')
+    key = key.strip().lower()
+    if key == 'state':
+        return ItemTable.c.state == parse_state(value)
+    if key == 'signifier':
+        signifier = parse_signifier(value)
+        if signifier is None:
+            return ItemTable.c.signifier.is_(None)
+        return ItemTable.c.signifier == signifier
+    raise RuntimeError(f'Invalid filter {where}. Filters are state=... and signifier=...')
+
+
+def run_update(session: sql.orm.Session, update: Callable[[], int], action: str,
+               dry_run: bool, confirm: bool = False) -> int:
+    """Runs a bulk update, which returns the number of items it touched.
+
+    `action` describes the update, with a `{}` for the number of items.
+
+    The update is rolled back for dry runs, so the count shown is always the
+    number of rows it touched. With `confirm`, it is also rolled back before
+    asking, so the database isn't locked while the prompt waits, and is run
+    again once confirmed. Returns the number of items updated.
+    """
+
+    num_items = update()
+    if not num_items or dry_run or confirm:
+        session.rollback()
+    if not num_items:
+        return 0
+    if dry_run:
+        click.echo(f'Would {action.format(num_items)}')
+        return num_items
+    if confirm:
+        if not click.confirm(f'{action.format(num_items).capitalize()}?'):
+            raise click.Abort()
+        num_items = update()
+    session.commit()
+    return num_items
+
+
+def mark_occurrence(state: str, id: int, at: datetime, dry_run: bool) -> None:
+    """Marks one occurrence of a series by storing it as an exception."""
+
     session = get_session()
-    item = session.query(Item).get(id)
-    if item is None:
+    series = session.get(Item, id)
+    if series is None:
         raise RuntimeError(f'Item {id} not found')
+    if series.recurrence is None or series.time is None:
+        raise RuntimeError(f'Item {id} is not recurring')
+
+    day = datetime.combine(at.date(), datetime.min.time())
+    occurrence = next(iter_occurrences(series.recurrence, series.time, day), None)
+    if occurrence is None or occurrence.date() != at.date():
+        raise RuntimeError(f'Item {id} has no occurrence on {at.strftime(DATE_FORMAT)}')
+    if dry_run:
+        click.echo(f'Would mark the occurrence of item {id} at '
+                   f'{occurrence.strftime(Item.TIME_FORMAT)}')
+        return
+
+    exception = get_exception(session, series, occurrence)
+    choice = parse_choice(state)
+    if isinstance(choice, ItemState):
+        exception.state = choice
+    else:
+        exception.signifier = choice
+    session.commit()
+    click.echo(exception)
+    if choice is None:
+        click.echo(f'Cleared signifier for this occurrence of item {id}')
+    else:
+        click.echo(f'Marked this occurrence of item {id} as {choice.value}')
+
+
+@cli.command(help='Update item state')
+@click.argument('state', type=str, shell_complete=complete_choices)
+@click.argument('ids', type=str, required=False, shell_complete=complete_ids)
+@click.option('-w', '--where', multiple=True,
+              help='Only update items matching a filter like state=incomplete')
+@click.option('--before', help='Only update items scheduled before this time')
+@click.option('-d', '--dry-run', is_flag=True, help='Count matching items without updating them')
+@click.option('--at', help='Only update the occurrence of a recurring item at this time')
+def mark(state: str, ids: Optional[str], where: List[str], before: Optional[str],
+         dry_run: bool, at: Optional[str]) -> None:
+    if at is not None:
+        if ids is None or not ids.strip().isdigit() or where or before is not None:
+            raise click.UsageError('--at takes the ID of one recurring item')
+        mark_occurrence(state, int(ids), parse_time(at), dry_run)
+        return
+    if ids is None and not where and before is None:
+        raise click.UsageError('Pass item IDs like 12-40,55 or at least one filter')
+
+    clauses = []
+    if ids is not None:
+        clauses.append(ids_in_ranges(parse_id_ranges(ids)))
+    clauses.extend(parse_where(w) for w in where)
+    if before is not None:
+        clauses.append(ItemTable.c.time < parse_time(before))
 
     state = parse_choice(state)
     if isinstance(state, ItemState):
-        item.state = state
-        ostr = f'Marked item {id} as {state.value}'
+        values, action = {'state': state}, f'mark {{}} items as {state.value}'
     elif isinstance(state, ItemSignifier):
-        item.signifier = state
-        ostr = f'Marked item {id} as {state.value}'
+        values, action = {'signifier': state}, f'mark {{}} items as {state.value}'
     else:
-        item.signifier = None
-        ostr = f'Cleared signifier for item {id}'
-    session.commit()
-    click.echo(item)
-    click.echo(ostr)
+        values, action = {'signifier': None}, 'clear signifier for {} items'
+
+    session = get_session()
+    num_items = run_update(session, lambda: update_items(session, sql.and_(*clauses), values),
+                           action, dry_run)
+    if dry_run:
+        return
+    if not num_items:
+        raise RuntimeError('No matching items found')
+
+    # Keeps the old output for a single item.
+    if ids is not None and ids.strip().isdigit():
+        click.echo(session.get(Item, int(ids)))
+        if state is None:
+            click.echo(f'Cleared signifier for item {int(ids)}')
+        else:
+            click.echo(f'Marked item {int(ids)} as {state.value}')
+    elif state is None:
+        click.echo(f'Cleared signifier for {num_items} items')
+    else:
+        click.echo(f'Marked {num_items} items as {state.value}')
 
 
 @cli.command(help='Mark past items as complete')
-def complete() -> None:
+@click.option('-d', '--dry-run', is_flag=True, help='Count past items without updating them')
+def complete(dry_run: bool) -> None:
     session = get_session()
-
-    items = session.query(Item) \
-        .filter(Item.time < datetime.now()) \
-        .filter(Item.state != ItemState.COMPLETE)
-    num_items = items.count()
-    if num_items:
-        if click.confirm(f'Mark {num_items} items as complete?', abort=True):
-            items.update({'state': ItemState.COMPLETE})
-            session.commit()
-            click.echo(f'Completed {num_items} items')
-    else:
+    num_items = run_update(
+        session,
+        lambda: update_items(session, overdue_query().whereclause, {'state': ItemState.COMPLETE}),
+        'mark {} items as complete', dry_run, confirm=True)
+    if not num_items:
         click.echo('All past items are complete')
+    elif not dry_run:
+        click.echo(f'Completed {num_items} items')
+
+
+@cli.command(help='Carry open items forward from a period')
+@click.option('-f', '--from', 'start', help='Start of the period; defaults to last month')
+@click.option('-t', '--to', 'end', help='End of the period; defaults to this month')
+@click.option('-d', '--dry-run', is_flag=True, help='Count open items without migrating them')
+def migrate(start: Optional[str], end: Optional[str], dry_run: bool) -> None:
+    this_month = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    last_month = (this_month - timedelta(days=1)).replace(day=1)
+    start_time = last_month if start is None else parse_time(start)
+    end_time = this_month if end is None else parse_time(end)
+    if start_time >= end_time:
+        raise click.UsageError('The period has to start before it ends')
+
+    session = get_session()
+    num_items = run_update(session, lambda: migrate_items(session, start_time, end_time),
+                           'migrate {} items', dry_run, confirm=True)
+    if not num_items:
+        click.echo('No open items to migrate')
+    elif not dry_run:
+        click.echo(f'Migrated {num_items} items')
+
+
+@cli.command(help='Move old finished items to the archive')
+@click.option('-o', '--older-than', required=True,
+              help='Only archive items that last changed before this time')
+@click.option('-d', '--dry-run', is_flag=True, help='Count finished items without archiving them')
+def archive(older_than: str, dry_run: bool) -> None:
+    older_than_time = parse_time(older_than)
+    if older_than_time is None:
+        raise click.UsageError('--older-than needs a time')
+
+    session = get_session()
+    try:
+        num_items = run_update(session, lambda: archive_items(session, older_than_time),
+                               'archive {} items', dry_run, confirm=True)
+    except RuntimeError as e:
+        session.rollback()
+        raise click.ClickException(str(e))
+    if not num_items:
+        click.echo('No finished items to archive')
+    elif not dry_run:
+        click.echo(f'Archived {num_items} items to {get_archive_path()}')
 
 
 @cli.command(help='Run a text query on all items')
 @click.argument('substring')
 @click.option('-s', '--show-complete', is_flag=True, help='If set, show completed items')
-def query(substring: str, show_complete: bool) -> None:
-    session = get_session()
-    query = session.query(Item).filter(Item.description.contains(substring))
+@click.option('-f', '--full-text', is_flag=True,
+              help='Use the search index, which supports tokens, prefixes (foo*) '
+                   'and phrases ("foo bar")')
+@click.option('-o', '--order', type=click.Choice(['rank', 'updated']),
+              help='Result order; defaults to rank for full-text queries')
+@click.option('-a', '--include-archive', is_flag=True,
+              help='Also query archived items; the search index only covers the journal')
+def query(substring: str, show_complete: bool, full_text: bool, order: Optional[str],
+          include_archive: bool) -> None:
+    session = get_session(include_archive)
+    if order is None:
+        order = 'rank' if full_text else 'updated'
+    if order == 'rank' and not full_text:
+        raise click.UsageError('Ranking requires --full-text')
+
+    if full_text:
+        query = search_items(substring)
+    else:
+        query = select_records().where(ItemTable.c.description.contains(substring))
     if not show_complete:
-        query = query.filter(Item.state != ItemState.COMPLETE)
-    items = query.order_by(Item.time_updated.desc())
-    render_items(items, 'Matching Items', 'No matching items found')
+        query = query.where(ItemTable.c.state != ItemState.COMPLETE)
+    if order == 'rank':
+        items = query.order_by(search_rank())
+    else:
+        items = query.order_by(ItemTable.c.time_updated.desc())
+
+    try:
+        render_items(session, items, 'Matching Items', 'No matching items found')
+    except sql.exc.OperationalError as e:
+        raise click.ClickException(f'Invalid search query: {e.orig}')
+
+
+def read_checkpoint(path: str) -> Optional[datetime]:
+    """Reads a checkpoint file; a missing or empty file means a full export."""
+
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        checkpoint = f.read().strip()
+    return parse_timestamp(checkpoint) if checkpoint else None
 
 
 @cli.command('export', help='Exports events to JSON')
 @click.argument('file', default='-')
-def export_func(file: str) -> None:
-    session = get_session()
-    all_items = [item.as_dict() for item in session.query(Item)]
+@click.option('-f', '--format', 'fmt', type=click.Choice(['json', 'jsonl', 'snapshot']),
+              default='json', help='JSON array, one JSON object per line, or a binary snapshot')
+@click.option('-b', '--batch-size', type=click.IntRange(min=1), default=1000,
+              help='Number of rows fetched per round trip')
+@click.option('--since', help='Only export changes after this timestamp')
+@click.option('--checkpoint', type=click.Path(dir_okay=False),
+              help='Only export changes after the time stored in this file, then update it; '
+                   'a missing or empty file exports everything')
+@click.option('-c', '--compression', type=click.Choice(['none', 'zlib', 'lzma']),
+              default='zlib', help='Compression for snapshots')
+def export_func(file: str, fmt: str, batch_size: int, since: Optional[str],
+                checkpoint: Optional[str], compression: str) -> None:
+    if since is not None and checkpoint is not None:
+        raise click.UsageError('Use either --since or --checkpoint, not both')
+    if fmt == 'snapshot':
+        if since is not None or checkpoint is not None:
+            raise click.UsageError('Snapshots always contain the whole journal')
+
+        from bojo.snapshot import write_snapshot
+
+        # Like full exports, snapshots include archived items.
+        session = get_session(include_archive=True)
+        with click.open_file(file, 'wb') as f:
+            write_snapshot(session, f, compression, batch_size)
+        return
+
+    since_time = None
+    if since is not None:
+        try:
+            since_time = parse_timestamp(since)
+        except RuntimeError as e:
+            raise click.BadParameter(str(e), param_hint='--since')
+    elif checkpoint is not None:
+        try:
+            since_time = read_checkpoint(checkpoint)
+        except RuntimeError as e:
+            raise click.ClickException(f'Invalid checkpoint file {checkpoint}: {e}')
+
+    # Full exports include archived items. Changes since a time don't need
+    # them, since archived items never change.
+    session = get_session(include_archive=since_time is None)
+    export_time = get_current_time(session)
+    items = select_records().order_by(ItemTable.c.id)
+    deleted = []
+    if since_time is not None:
+        items = items.where(changed_since(since_time))
+        deleted = deleted_since(session, since_time)
+
+    records = itertools.chain(
+        (record.as_dict() for record in fetch_records(session, items, batch_size)),
+        ({'id': id, 'deleted': True} for id in deleted),
+    )
     with click.open_file(file, 'w') as f:
-        json.dump(all_items, f, indent=2)
+        if fmt == 'jsonl':
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        else:
+            json.dump(list(records), f, indent=2)
+
+    if checkpoint is not None:
+        with open(checkpoint, 'w') as f:
+            f.write(export_time.isoformat())
 
 
 @cli.command('import', help='Imports events from JSON')
 @click.argument('file', default='-')
-def import_func(file: str) -> None:
+@click.option('-f', '--format', 'fmt', type=click.Choice(['json', 'jsonl', 'snapshot']),
+              default='json', help='JSON array, one JSON object per line, or a binary snapshot')
+@click.option('-b', '--batch-size', type=click.IntRange(min=1), default=1000,
+              help='Number of rows inserted per transaction')
+@click.option('-m', '--merge', is_flag=True,
+              help='Overwrite items with the same ID and apply deletions')
+def import_func(file: str, fmt: str, batch_size: int, merge: bool) -> None:
     session = get_session()
-    click.get_text_stream('stdin')
-    all_items = []
+    if fmt == 'snapshot':
+        from bojo.snapshot import iter_snapshot_rows
+
+        # Restores run as one transaction with the triggers' work done once at
+        # the end, rather than per row.
+        try:
+            with bulk_load(session):
+                if file == '-':
+                    data = click.get_binary_stream('stdin').read()
+                    num_items = insert_rows(session, iter_snapshot_rows(data),
+                                            batch_size, merge, commit=False)
+                else:
+                    with open(file, 'rb') as f:
+                        # Empty files can't be mapped.
+                        if not os.fstat(f.fileno()).st_size:
+                            raise RuntimeError('Snapshot is empty')
+                        # The rows have to be closed, releasing their views of
+                        # the map, before the map is.
+                        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data, \
+                                contextlib.closing(iter_snapshot_rows(data)) as rows:
+                            num_items = insert_rows(session, rows, batch_size, merge,
+                                                    commit=False)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        click.echo(f'Added {num_items} items')
+        return
+
+    with click.open_file(file, 'r') as f:
+        if fmt == 'jsonl':
+            item_dicts = (json.loads(line) for line in f if line.strip())
+        else:
+            item_dicts = json.load(f)
+        try:
+            num_items = import_items(session, item_dicts, batch_size, merge)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+    click.echo(f'Added {num_items} items')
+
+
+def parse_time(time: str) -> Optional[datetime]:
+    if time == NONE_STR:
+        return None
+
+    parsed = parse_phrase(time)
+    if parsed is None:
+        raise RuntimeError(f'Invalid time {time}')
+    return parsed
+
+
+def add_batch(ctx: click.Context, param: click.Parameter, file: Optional[str]) -> None:
+    if file is None or ctx.resilient_parsing:
+        return
+
+    rows = []
     with click.open_file(file, 'r') as f:
-        for item_str in json.load(f):
-            all_items.append(Item.from_dict(item_str))
+        for line_num, line in enumerate(f, 1):
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            try:
+                rows.append(parse_batch_line(line))
+            except (RuntimeError, ValueError) as e:
+                raise click.ClickException(f'Line {line_num}: {e}')
+
+    # IDs are assigned up front, so parents can refer to other rows in the
+    # batch as `@N` (the Nth row) without a round trip per row.
     session = get_session()
-    session.add_all(all_items)
-    session.commit()
-    click.echo(f'Added {len(all_items)} items')
+    first_id = session.execute(sql.select(next_item_id())).scalar()
+    items = []
+    for i, row in enumerate(rows):
+        try:
+            parent = row['parent']
+            if parent == NONE_STR:
+                parent_id = None
+            elif parent.startswith('@'):
+                ref = int(parent[1:])
+                if not 1 <= ref <= len(rows):
+                    raise RuntimeError(f'Invalid parent reference {parent}')
+                parent_id = first_id + ref - 1
+            else:
+                parent_id = int(parent)
+
+            items.append({
+                'id': first_id + i,
+                'description': row['description'],
+                'state': parse_state(row['state']),
+                'signifier': parse_signifier(row['signifier']),
+                'parent_id': parent_id,
+                'time': parse_time(row['time']),
+            })
+        except (RuntimeError, ValueError) as e:
+            raise click.ClickException(f'Row {i + 1}: {e}')
+
+    if items:
+        session.execute(Item.__table__.insert(), items)
+        session.commit()
+    click.echo(f'Added {len(items)} items')
+    ctx.exit()
 
 
 @cli.command(help='Adds a new item')
+@click.option('-b', '--batch', type=click.Path(allow_dash=True), is_eager=True,
+              expose_value=False, callback=add_batch,
+              help='Add items from a TSV/JSONL file (or - for stdin) without prompting')
 @click.option('-d', '--description', prompt=f'Description',
               help='The description of the item being added')
-@click.option('-s', '--state', prompt=STATE_PROMPT,
+@click.option('-s', '--state', prompt=STATE_PROMPT, shell_complete=complete_choices,
               help='The state of the item being added')
-@click.option('--signifier', prompt=SIGNIFIER_PROMPT,
+@click.option('--signifier', prompt=SIGNIFIER_PROMPT, shell_complete=complete_choices,
               default=NONE_STR, help='The signifier of the item being added')
-@click.option('-p', '--parent', prompt='Parent', default=NONE_STR,
+@click.option('-p', '--parent', prompt='Parent', default=NONE_STR, shell_complete=complete_ids,
               help='The parent ID of the item being added')
 @click.option('-t', '--time', prompt='Time', default=NONE_STR,
               help='The time of the item being added')
-def add(description: str, state: str, signifier: str, parent: str, time: str) -> None:
+@click.option('-r', '--repeat',
+              help='Repeat the item, like "weekly" or "FREQ=WEEKLY;BYDAY=MO,WE"')
+def add(description: str, state: str, signifier: str, parent: str, time: str,
+        repeat: Optional[str]) -> None:
     # Parses the parent.
-    if parent != NONE_STR:
-        parent = int(parent)
+    parent_id = None if parent == NONE_STR else int(parent)
 
     state = parse_state(state)
     signifier = parse_signifier(signifier)
 
-    # Parses the time.
-    if time != NONE_STR:
-        time = dateparser.parse(time)
-    else:
-        time = None
+    time = parse_time(time)
+
+    # Checks the recurrence rule; the time is the first occurrence.
+    if repeat is not None:
+        parse_recurrence(repeat)
+        if time is None:
+            raise RuntimeError('Repeated items need a time')
 
     # Creates the item to insert.
-    item = Item(description=description, state=state,
-                signifier=signifier, time=time, parent_id=parent)
+    item = Item(description=description, state=state, signifier=signifier,
+                time=time, parent_id=parent_id, recurrence=repeat)
 
     click.echo(item)
     if click.confirm('Do you want to add this item?', abort=True):
         session = get_session()
+        item.id = next_item_id()
         session.add(item)
         session.commit()
         click.echo('Added item')
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+"""Shell completion for item IDs and states, served from a cache file.
+
+The cache is a JSON header line, with the change counter it was built at and
+the state and signifier choices, then one `id<TAB>description` line for each
+of the newest items, newest first. Commands that touch the database rewrite
+it on exit if the journal changed, so reading it only needs the standard
+library. `client.py` answers completions for IDs and states from it without
+importing click or SQLAlchemy; everything else, including older IDs the cache
+doesn't hold, falls back to click's own completion.
+"""
+
+import json
+import os
+import shlex
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from bojo.config import get_bojo_root
+
+# Maximum number of IDs offered at once, newest first.
+MAX_ID_COMPLETIONS = 100
+
+# Maximum length of the description shown next to an ID.
+MAX_HELP_LENGTH = 60
+
+# Number of the newest IDs kept in the cache, so rewriting it stays cheap on
+# large journals. Older IDs are completed from the database.
+MAX_CACHED_IDS = 1000
+
+# Options that take a value, per command, so positional arguments can be
+# counted without loading the commands.
+VALUE_OPTIONS = {
+    'add': {'-b', '--batch', '-d', '--description', '-s', '--state', '--signifier',
+            '-p', '--parent', '-t', '--time', '-r', '--repeat'},
+    'delete': set(),
+    'mark': {'-w', '--where', '--before', '--at'},
+}
+
+Completion = Tuple[str, Optional[str]]
+
+
+def get_cache_path() -> Path:
+    return get_bojo_root() / 'completion.tsv'
+
+
+def read_header(path: Path) -> Dict[str, Any]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.loads(f.readline())
+    except (OSError, ValueError):
+        return {}
+
+
+def format_help(description: str) -> str:
+    return ' '.join(description.split())[:MAX_HELP_LENGTH]
+
+
+def refresh_cache(force: bool = False) -> None:
+    """Rewrites the cache if the journal changed since it was written.
+
+    Unless `force` is set, this does nothing if this process never opened
+    the database, since then it can't have changed it.
+    """
+
+    import sqlalchemy as sql
+
+    from bojo.db import get_change_counter, get_engine, get_session, ItemTable
+    from bojo.render_utils import ALL_CHOICES
+
+    if not force and not get_engine.cache_info().currsize:
+        return
+
+    path = get_cache_path()
+    session = get_session()
+    try:
+        change_counter = get_change_counter(session)
+        if read_header(path).get('change_counter') == change_counter:
+            return
+        rows = session.execute(
+            sql.select(ItemTable.c.id, ItemTable.c.description)
+            .order_by(ItemTable.c.id.desc())
+            .limit(MAX_CACHED_IDS + 1)).all()
+
+        # Writes to a temporary file first, so readers never see half a cache.
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            header = {
+                'change_counter': change_counter,
+                'choices': ALL_CHOICES,
+                'truncated': len(rows) > MAX_CACHED_IDS,
+            }
+            f.write(json.dumps(header) + '\n')
+            for id, description in rows[:MAX_CACHED_IDS]:
+                f.write(f'{id}\t{format_help(description)}\n')
+        os.replace(tmp_path, path)
+    finally:
+        session.close()
+
+
+def read_ids(incomplete: str) -> Optional[List[Completion]]:
+    """Returns the cached IDs starting with `incomplete`, newest first.
+
+    Returns None if older IDs the cache doesn't hold might be missing.
+    """
+
+    path = get_cache_path()
+    if not path.exists():
+        refresh_cache(force=True)
+    try:
+        f = open(path, encoding='utf-8')
+    except OSError:
+        return []
+    with f:
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            header = {}
+        ids: List[Completion] = []
+        for line in f:
+            if line.startswith(incomplete):
+                id, _, description = line.rstrip('\n').partition('\t')
+                ids.append((id, description or None))
+                if len(ids) >= MAX_ID_COMPLETIONS:
+                    return ids
+    return None if header.get('truncated') else ids
+
+
+def query_ids(incomplete: str) -> List[Completion]:
+    """Returns the IDs starting with `incomplete` from the database, newest first."""
+
+    import sqlalchemy as sql
+
+    from bojo.db import get_session, ItemTable
+
+    session = get_session()
+    try:
+        rows = session.execute(
+            sql.select(ItemTable.c.id, ItemTable.c.description)
+            .where(sql.cast(ItemTable.c.id, sql.String).startswith(incomplete, autoescape=True))
+            .order_by(ItemTable.c.id.desc())
+            .limit(MAX_ID_COMPLETIONS))
+        return [(str(id), format_help(description) or None) for id, description in rows]
+    finally:
+        session.close()
+
+
+def split_last_id(incomplete: str) -> Tuple[str, str]:
+    """Splits the last ID off a list of IDs and ranges, like `12-40,5`."""
+
+    head, sep, last = incomplete.rpartition(',')
+    low, range_sep, last = last.rpartition('-')
+    return head + sep + low + range_sep, last
+
+
+def cached_id_completions(incomplete: str) -> Optional[List[Completion]]:
+    """Completes the last ID from the cache alone, or returns None if it can't."""
+
+    prefix, last = split_last_id(incomplete)
+    ids = read_ids(last)
+    if ids is None:
+        return None
+    return [(prefix + id, help) for id, help in ids]
+
+
+def id_completions(incomplete: str) -> List[Completion]:
+    """Completes the last ID, looking up IDs the cache doesn't hold."""
+
+    prefix, last = split_last_id(incomplete)
+    ids = read_ids(last)
+    if ids is None:
+        ids = query_ids(last)
+    return [(prefix + id, help) for id, help in ids]
+
+
+def choice_completions(incomplete: str) -> List[Completion]:
+    path = get_cache_path()
+    if not path.exists():
+        refresh_cache(force=True)
+    choices = read_header(path).get('choices', [])
+    return [(choice, None) for choice in choices if choice.startswith(incomplete)]
+
+
+def split_words(s: str) -> List[str]:
+    """Splits a command line like the shell, allowing an unfinished last word."""
+
+    lex = shlex.shlex(s, posix=True)
+    lex.whitespace_split = True
+    lex.commenters = ''
+    words: List[str] = []
+    try:
+        words.extend(lex)
+    except ValueError:
+        words.append(lex.token)
+    return words
+
+
+def get_completion_args(shell: str) -> Tuple[List[str], str]:
+    """Returns the words before the cursor and the word being completed.
+
+    This reads the same environment variables as click's completion scripts.
+    """
+
+    words = split_words(os.environ['COMP_WORDS'])
+    if shell == 'fish':
+        incomplete = os.environ['COMP_CWORD']
+        if incomplete and words and words[-1] == incomplete:
+            words.pop()
+        return words[1:], incomplete
+
+    cword = int(os.environ['COMP_CWORD'])
+    incomplete = words[cword] if cword < len(words) else ''
+    return words[1:cword], incomplete
+
+
+def find_completions(args: List[str], incomplete: str) -> Optional[List[Completion]]:
+    """Completes IDs and states, or returns None for anything else.
+
+    This also returns None for IDs the cache can't complete by itself.
+    """
+
+    args = [arg for arg in args if arg not in ('--trace', '--profile-startup')]
+    if not args or args[0] not in VALUE_OPTIONS or incomplete.startswith('-'):
+        return None
+    command, value_options = args[0], VALUE_OPTIONS[args[0]]
+
+    # Option values.
+    if args[-1] in value_options:
+        if command == 'add' and args[-1] in ('-p', '--parent'):
+            return cached_id_completions(incomplete)
+        if command == 'add' and args[-1] in ('-s', '--state', '--signifier'):
+            return choice_completions(incomplete)
+        return None
+
+    # Positional arguments.
+    positional = []
+    rest = iter(args[1:])
+    for arg in rest:
+        if arg in value_options:
+            next(rest, None)
+        elif not arg.startswith('-') or arg == '-':
+            positional.append(arg)
+    if command == 'delete' and not positional:
+        return cached_id_completions(incomplete)
+    if command == 'mark' and not positional:
+        return choice_completions(incomplete)
+    if command == 'mark' and len(positional) == 1:
+        return cached_id_completions(incomplete)
+    return None
+
+
+def format_completion(shell: str, value: str, help: Optional[str]) -> str:
+    """Formats a plain completion the way click's completion scripts expect."""
+
+    if shell == 'zsh':
+        if help:
+            # Colons separate the value from its help, so they are escaped.
+            value = value.replace(':', '\\:')
+            return f'plain\n{value}\n{help}'
+        return f'plain\n{value}\n_'
+    if shell == 'fish' and help:
+        return f'plain,{value}\t{help}'
+    return f'plain,{value}'
+
+
+def fast_complete() -> bool:
+    """Answers a completion request from the cache, if it is for IDs or states.
+
+    Returns False if click has to handle the request instead.
+    """
+
+    mode = os.environ.get('_BOJO_COMPLETE', '')
+    shell, _, action = mode.partition('_')
+    if action != 'complete' or shell not in ('bash', 'fish', 'zsh'):
+        return False
+
+    # Without a cache, click's completion builds it.
+    if not get_cache_path().exists():
+        return False
+
+    args, incomplete = get_completion_args(shell)
+    completions = find_completions(args, incomplete)
+    if completions is None:
+        return False
+    print('\n'.join(format_completion(shell, value, help) for value, help in completions))
+    return True
@@ -1,9 +1,21 @@
 #!/usr/bin/env python
 
+import functools
 import os
 from pathlib import Path
+from typing import Dict
 
+# Pragmas applied to every SQLite connection; see `get_sqlite_pragmas`.
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': '268435456',
+    'cache_size': '-16000',
+    'temp_store': 'memory',
+}
 
+
+@functools.lru_cache(maxsize=None)
 def get_bojo_root() -> Path:
     """Returns the root directory for logging data."""
 
@@ -12,13 +24,51 @@ def get_bojo_root() -> Path:
     # Can set this environment variable to override.
     if 'BOJO_ROOT' in os.environ:
         root_dir = Path(os.environ['BOJO_ROOT'])
-    
+
     # Makes environment if it doesn't exist yet.
-    if not os.path.exists(root_dir):
-        os.makedirs(root_dir, mode=0o700, exist_ok=True)
-    
+    os.makedirs(root_dir, mode=0o700, exist_ok=True)
+
     return root_dir
 
 
+def get_daemon_socket() -> Path:
+    """Returns the Unix socket that `bojo daemon` listens on."""
+
+    return get_bojo_root() / 'daemon.sock'
+
+
+def should_use_daemon() -> bool:
+    return 'BOJO_NO_DAEMON' not in os.environ
+
+
 def should_use_verbose() -> bool:
     return 'BOJO_VERBOSE' in os.environ
+
+
+def should_use_trace() -> bool:
+    return 'BOJO_TRACE' in os.environ
+
+
+def get_trace_format() -> str:
+    """Returns `json` if `BOJO_TRACE=json`, otherwise `text`."""
+
+    return 'json' if os.environ.get('BOJO_TRACE', '').lower() == 'json' else 'text'
+
+
+def get_sqlite_pragmas() -> Dict[str, str]:
+    """Returns the pragmas to apply to each database connection.
+
+    The defaults can be overridden with a comma-separated list in the
+    `BOJO_PRAGMAS` environment variable, like `synchronous=full,mmap_size=0`.
+    """
+
+    pragmas = dict(DEFAULT_SQLITE_PRAGMAS)
+    for pragma in os.environ.get('BOJO_PRAGMAS', '').split(','):
+        if not pragma.strip():
+            continue
+        name, sep, value = pragma.partition('=')
+        name, value = name.strip().lower(), value.strip()
+        if not sep or not name.isidentifier() or not value.replace('-', '').isalnum():
+            raise RuntimeError(f'Invalid pragma in BOJO_PRAGMAS: {pragma}')
+        pragmas[name] = value
+    return pragmas
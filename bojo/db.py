@@ -1,15 +1,27 @@
 #!/usr/bin/env python
 
+import contextlib
 import enum
+import functools
+import heapq
+import itertools
 import json
+import sqlite3
+from collections import defaultdict
 from datetime import datetime
-from typing import Any, Dict, NamedTuple, Optional
+from pathlib import Path
+from typing import (
+    Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union,
+)
 
 import sqlalchemy as sql
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
 from termcolor import colored
 
-from bojo.config import get_bojo_root, should_use_verbose
+from bojo.config import get_bojo_root, get_sqlite_pragmas, should_use_verbose
+from bojo.profiling import trace_engine, trace_phase
+from bojo.recurrence import iter_occurrences
 
 
 Base = declarative_base()
@@ -50,9 +62,23 @@ ItemSignifierDict = {
 }
 ItemSignifierDictInv = {v: k for k, v in ItemSignifierDict.items()}
 
+DATE_FORMAT = '%A, %B %d, %Y'
+CLOCK_FORMAT = '%I:%M %p'
+
 
 class Item(Base):
     __tablename__ = 'item'
+    __table_args__ = (
+        # Access paths used by the `list` subcommands and `complete`.
+        sql.Index('ix_item_signifier_time', 'signifier', 'time'),
+        sql.Index('ix_item_state_time', 'state', 'time'),
+        sql.Index('ix_item_state_time_updated', 'state', 'time_updated'),
+        sql.Index('ix_item_time_state', 'time', 'state'),
+        sql.Index('ix_item_parent_id', 'parent_id'),
+        # Recurring series, and the stored exceptions to their occurrences.
+        sql.Index('ix_item_recurring', 'state', 'signifier', sqlite_where=sql.text('recurrence IS NOT NULL')),
+        sql.Index('ix_item_recurrence_id_time', 'recurrence_id', 'recurrence_time'),
+    )
 
     id = sql.Column(sql.Integer, primary_key=True)
     description = sql.Column(sql.Text, nullable=False)
@@ -62,6 +88,14 @@ class Item(Base):
     time_created = sql.Column(sql.DateTime, server_default=sql.sql.func.now())
     time_updated = sql.Column(sql.DateTime, onupdate=sql.sql.func.now())
 
+    # A recurring item (a series) has a rule from `bojo.recurrence`, and its
+    # time is the first occurrence. Occurrences are expanded when listed; only
+    # an occurrence that changed, like a completed one, is stored as its own
+    # item, with the series ID and the time of the occurrence it replaces.
+    recurrence = sql.Column(sql.String)
+    recurrence_id = sql.Column(sql.Integer)
+    recurrence_time = sql.Column(sql.DateTime)
+
     parent_id = sql.Column(sql.Integer, sql.ForeignKey('item.id'))
     children = sql.orm.relationship('Item',
                                     single_parent=True,
@@ -107,19 +141,13 @@ class Item(Base):
         strs.append(colored('Autocomplete', attrs=['underline']))
         strs.append(
             'To enable autocomplete, add the right setting to your shell:')
-        strs.append('  eval "$(_BOJO_COMPLETE=source_bash bojo)"')
-        strs.append('  eval "$(_BOJO_COMPLETE=source_zsh bojo)"')
-        strs.append('  eval "$(_BOJO_COMPLETE=source_fish bojo)"')
+        strs.append('  eval "$(_BOJO_COMPLETE=bash_source bojo)"')
+        strs.append('  eval "$(_BOJO_COMPLETE=zsh_source bojo)"')
+        strs.append('  _BOJO_COMPLETE=fish_source bojo | source')
 
         return '\n'.join(strs)
 
-    TIME_FORMAT = '%A, %B %d, %Y at %I:%M %p'
-
-    @classmethod
-    def __format_time(cls, t: Optional[datetime]) -> Optional[str]:
-        if t is None:
-            return None
-        return t.strftime(cls.TIME_FORMAT)
+    TIME_FORMAT = f'{DATE_FORMAT} at {CLOCK_FORMAT}'
 
     @classmethod
     def __from_time(cls, s: Optional[str]) -> Optional[datetime]:
@@ -133,83 +161,828 @@ class Item(Base):
         verbose_mode: bool = False
 
     def render(self, **kwargs) -> str:
+        from bojo.render_utils import iter_tree, render_rows
+
         if 'verbose_mode' not in kwargs:
             kwargs['verbose_mode'] = should_use_verbose()
 
         render_opts = self.RenderOpts(**kwargs)
-        color = ItemStateColor[self.state]
-        rep = colored(self.description, color)
+        rows = iter_tree([self],
+                         lambda item: item.children if render_opts.show_children else [],
+                         render_opts.show_complete_children)
+        return '\n'.join(render_rows(rows, render_opts.verbose_mode))
 
-        state_symbol = ItemStateDictInv[self.state]
-        if render_opts.verbose_mode:
-            state_symbol = f'{state_symbol} ({self.state.value})'
-        rep = f'{state_symbol} {rep}'
+    def __repr__(self) -> str:
+        return self.render()
 
-        signifier_symbol = ItemSignifierDictInv.get(self.signifier, None)
-        if signifier_symbol is not None:
-            if render_opts.verbose_mode:
-                signifier_symbol = f'{signifier_symbol} ({self.signifier.value})'
+    def as_dict(self) -> Dict[str, Any]:
+        return item_as_dict(self)
 
-            rep = f'{signifier_symbol} {rep}'
+    @classmethod
+    def row_from_dict(cls, item_dict: Dict[str, Any]) -> Dict[str, Any]:
+        """Converts an `as_dict` dictionary to column values for a bulk insert."""
+
+        return {
+            'id': item_dict['id'],
+            'description': item_dict['description'],
+            'state': ItemState(item_dict['state']),
+            'signifier': ItemSignifier(
+                item_dict['signifier']) if 'signifier' in item_dict else None,
+            'time': cls.__from_time(item_dict.get('time', None)),
+            'time_created': cls.__from_time(item_dict.get('time_created', None)),
+            'time_updated': cls.__from_time(item_dict.get('time_updated', None)),
+            'parent_id': item_dict.get('parent_id', None),
+            'recurrence': item_dict.get('recurrence', None),
+            'recurrence_id': item_dict.get('recurrence_id', None),
+            'recurrence_time': cls.__from_time(item_dict.get('recurrence_time', None)),
+        }
 
-            if self.signifier == ItemSignifier.PRIORITY:
-                rep = colored(rep, attrs=['bold'])
+    @classmethod
+    def from_dict(cls, item_dict: Dict[str, Any]) -> 'Item':
+        return cls(**cls.row_from_dict(item_dict))
+
+
+ItemTable = Item.__table__
 
-        if self.time is not None:
-            t = self.__format_time(self.time)
-            t = colored(t, attrs=['dark'])
-            rep = f'{rep} {t}'
 
-        if self.id is not None:
-            sid = colored(self.id, attrs=['underline'])
-            rep = f'{sid} {rep}'
+def format_time(t: Optional[datetime]) -> Optional[str]:
+    if t is None:
+        return None
+    return t.strftime(Item.TIME_FORMAT)
+
+
+def item_as_dict(item: Any) -> Dict[str, Any]:
+    """Serializes an `Item` or `ItemRecord`, leaving out empty fields."""
+
+    item_dict = {
+        'id': item.id,
+        'description': item.description,
+        'state': item.state.value,
+        'signifier': None if item.signifier is None else item.signifier.value,
+        'time': format_time(item.time),
+        'time_created': format_time(item.time_created),
+        'time_updated': format_time(item.time_updated),
+        'parent_id': item.parent_id if isinstance(item.parent_id, int) else None,
+        'recurrence': item.recurrence,
+        'recurrence_id': item.recurrence_id,
+        'recurrence_time': format_time(item.recurrence_time),
+    }
+    return {k: v for k, v in item_dict.items() if v is not None}
+
+
+class ItemRecord(NamedTuple):
+    """A read-only item row, loaded without the ORM.
+
+    Listings use these instead of `Item`, which is only needed for writes.
+    """
+
+    id: int
+    description: str
+    state: ItemState
+    signifier: Optional[ItemSignifier]
+    time: Optional[datetime]
+    time_created: Optional[datetime]
+    time_updated: Optional[datetime]
+    parent_id: Optional[int]
+    recurrence: Optional[str]
+    recurrence_id: Optional[int]
+    recurrence_time: Optional[datetime]
 
-        # Adds sub-representations.
-        reps = [rep]
-        if render_opts.show_children:
-            for child in self.children:
-                if child.state == ItemState.COMPLETE and not render_opts.show_complete_children:
-                    continue
-                sub_rep = child.render(**render_opts._asdict())
-                reps.append('\n'.join(['  ' + c for c in sub_rep.split('\n')]))
+    def render(self, **kwargs) -> str:
+        from bojo.render_utils import render_rows
 
-        return '\n'.join(reps)
+        return render_rows([(0, self)], kwargs.get('verbose_mode'))[0]
 
     def __repr__(self) -> str:
         return self.render()
 
     def as_dict(self) -> Dict[str, Any]:
-        item_dict = {
-            'id': self.id,
-            'description': self.description,
-            'state': self.state.value,
-            'signifier': None if self.signifier is None else self.signifier.value,
-            'time': self.__format_time(self.time),
-            'time_created': self.__format_time(self.time_created),
-            'time_updated': self.__format_time(self.time_updated),
-            'parent_id': self.parent_id if isinstance(self.parent_id, int) else None,
-        }
-        return {k: v for k, v in item_dict.items() if v is not None}
+        return item_as_dict(self)
 
-    @classmethod
-    def from_dict(cls, item_dict: Dict[str, Any]) -> 'Item':
-        return cls(
-            id=item_dict['id'],
-            description=item_dict['description'],
-            state=ItemState(item_dict['state']),
-            signifier=ItemSignifier(
-                item_dict['signifier']) if 'signifier' in item_dict else None,
-            time=cls.__from_time(item_dict.get('time', None)),
-            time_created=cls.__from_time(item_dict.get('time_created', None)),
-            time_updated=cls.__from_time(item_dict.get('time_updated', None)),
-            parent_id=item_dict.get('parent_id', None),
-        )
 
-engine_url = f'sqlite:///{get_bojo_root() / "db.sqlite"}'
-engine = sql.create_engine(engine_url)
-Base.metadata.create_all(engine)
+def select_records() -> sql.sql.Select:
+    """Selects the columns of `ItemRecord`, for use with `fetch_records`."""
+
+    return sql.select(*(ItemTable.c[name] for name in ItemRecord._fields))
+
+
+def fetch_records(session: sql.orm.Session, stmt: sql.sql.Select,
+                  batch_size: int = 1000) -> Iterator[ItemRecord]:
+    """Runs a `select_records` statement, streaming rows in batches."""
+
+    with trace_phase('fetch'):
+        partitions = session.execute(stmt.execution_options(yield_per=batch_size)).partitions()
+    while True:
+        # Only the fetching is timed, not the caller's work between batches.
+        with trace_phase('fetch'):
+            partition = next(partitions, None)
+            records = [] if partition is None else [ItemRecord._make(row) for row in partition]
+        if partition is None:
+            break
+        yield from records
+
+
+def get_record(session: sql.orm.Session, id: int) -> Optional[ItemRecord]:
+    row = session.execute(select_records().where(ItemTable.c.id == id)).first()
+    return None if row is None else ItemRecord._make(row)
+
+
+def ids_in_ranges(ranges: List[Tuple[int, int]]) -> sql.sql.ColumnElement:
+    """Filters items whose ID falls in one of the inclusive `(low, high)` ranges."""
+
+    singles = [low for low, high in ranges if low == high]
+    clauses = [ItemTable.c.id.between(low, high) for low, high in ranges if low != high]
+    if singles:
+        clauses.append(ItemTable.c.id.in_(singles))
+    return sql.or_(*clauses)
+
+
+def update_items(session: sql.orm.Session, where: sql.sql.ColumnElement,
+                 values: Dict[str, Any]) -> int:
+    """Updates matching items in one statement, without committing.
+
+    Returns the number of updated items, so callers can confirm the change
+    and commit, or roll it back.
+    """
+
+    result = session.execute(ItemTable.update().where(where).values(**values))
+    return result.rowcount
+
+
+def migrate_items(session: sql.orm.Session, start: datetime, end: datetime) -> int:
+    """Migrates open items from the period `[start, end)`, without committing.
+
+    Incomplete items created or scheduled in the period, other than
+    recurring series, are copied as fresh, unscheduled items, then marked as
+    migrated. A copied item's parent is its parent's copy if the parent was
+    migrated too, otherwise the same parent. Returns the number of migrated
+    items.
+    """
+
+    def in_period(table: sql.Table) -> sql.sql.ColumnElement:
+        when = sql.func.coalesce(table.c.time, table.c.time_created)
+        return sql.and_(table.c.state == ItemState.INCOMPLETE, table.c.recurrence.is_(None),
+                        when >= start, when < end)
+
+    # Copies get consecutive IDs from `next_item_id`, in the order of the
+    # originals. A subquery rather than a CTE keeps the statement starting
+    # with INSERT, which the driver needs to open a transaction.
+    offset = session.execute(sql.select(next_item_id() - 1)).scalar()
+
+    def new_ids(name: str) -> sql.sql.Subquery:
+        new_id = offset + sql.func.row_number().over(order_by=ItemTable.c.id)
+        return sql.select(ItemTable.c.id.label('old_id'), new_id.label('new_id')) \
+            .where(in_period(ItemTable)).subquery(name)
+
+    copy, parent_copy = new_ids('copy'), new_ids('parent_copy')
+    copies = sql.select(
+        copy.c.new_id,
+        ItemTable.c.description,
+        sql.literal(ItemState.INCOMPLETE, ItemTable.c.state.type),
+        ItemTable.c.signifier,
+        sql.func.now(),
+        sql.func.coalesce(parent_copy.c.new_id, ItemTable.c.parent_id),
+    ).select_from(
+        ItemTable.join(copy, copy.c.old_id == ItemTable.c.id)
+        .outerjoin(parent_copy, parent_copy.c.old_id == ItemTable.c.parent_id))
+    columns = ['id', 'description', 'state', 'signifier', 'time_created', 'parent_id']
+    result = session.execute(ItemTable.insert().from_select(columns, copies))
+    if not result.rowcount:
+        return 0
+    originals = sql.and_(in_period(ItemTable), ItemTable.c.id <= offset)
+    return update_items(session, originals, {'state': ItemState.MIGRATED})
+
+
+def at_or_after(column: sql.sql.ColumnElement, since: datetime) -> sql.sql.ColumnElement:
+    """Filters a stored time to the second of `since` or later.
+
+    SQLite stamps times like `YYYY-MM-DD HH:MM:SS`, and SQLAlchemy writes them
+    with microseconds, and they compare as strings. Binding `since` without
+    its fraction of a second sorts it before both shapes of any time in the
+    same second, so changes made within that second are never missed.
+    """
+
+    return column >= sql.literal(since.strftime('%Y-%m-%d %H:%M:%S'), sql.String)
+
+
+def changed_since(since: datetime) -> sql.sql.ColumnElement:
+    """Filters items created or last updated in the second of `since` or later."""
+
+    return at_or_after(sql.func.coalesce(ItemTable.c.time_updated, ItemTable.c.time_created), since)
+
+
+# Serves `changed_since`; the expression has to match it exactly.
+sql.Index('ix_item_time_changed', sql.func.coalesce(Item.time_updated, Item.time_created))
+
+# Records deleted item IDs, so incremental exports can carry deletions.
+ItemTombstone = sql.table('item_tombstone', sql.column('id', sql.Integer),
+                          sql.column('time_deleted', sql.DateTime))
+
+
+def add_column(name: str, column_type: str,
+               table: str = 'item') -> Callable[[sql.engine.Connection], None]:
+    """Adds a column to a table; SQLite has no `ADD COLUMN IF NOT EXISTS`."""
+
+    def migrate(conn: sql.engine.Connection) -> None:
+        columns = {row.name for row in conn.execute(sql.text(f'PRAGMA table_info({table})'))}
+        if name not in columns:
+            conn.execute(sql.text(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}'))
+
+    return migrate
+
+
+def read_max_archived_id(conn: sql.engine.Connection) -> None:
+    """Records the largest ID in an archive written before it was tracked."""
+
+    path = get_archive_path()
+    if not path.exists():
+        return
+    with contextlib.closing(sqlite3.connect(str(path))) as archive:
+        max_id = archive.execute('SELECT max(id) FROM item').fetchone()[0]
+    conn.execute(sql.text('UPDATE journal_state SET max_archived_id = '
+                          'max(max_archived_id, :max_id)'), {'max_id': max_id or 0})
+
+
+# Number of recent changes kept in `item_change_log`.
+CHANGE_LOG_SIZE = 10000
+
+# Each entry upgrades the schema by one version. Fresh databases start at
+# version 0 and run every migration after `create_all`, so statements must be
+# idempotent. Statements are SQL, or functions of the connection.
+MIGRATIONS: List[List[Union[str, Callable[[sql.engine.Connection], None]]]] = [
+    [],  # 1: Initial schema.
+    [  # 2: Secondary indexes.
+        'CREATE INDEX IF NOT EXISTS ix_item_signifier_time ON item (signifier, time)',
+        'CREATE INDEX IF NOT EXISTS ix_item_state_time ON item (state, time)',
+        'CREATE INDEX IF NOT EXISTS ix_item_state_time_updated ON item (state, time_updated)',
+        'CREATE INDEX IF NOT EXISTS ix_item_time_state ON item (time, state)',
+    ],
+    [  # 3: Parent index for loading subtrees.
+        'CREATE INDEX IF NOT EXISTS ix_item_parent_id ON item (parent_id)',
+    ],
+    [  # 4: Full-text search index over descriptions.
+        "CREATE VIRTUAL TABLE IF NOT EXISTS item_fts USING fts5("
+        "description, content='item', content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS item_fts_insert AFTER INSERT ON item BEGIN "
+        "INSERT INTO item_fts (rowid, description) VALUES (new.id, new.description); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS item_fts_delete AFTER DELETE ON item BEGIN "
+        "INSERT INTO item_fts (item_fts, rowid, description) "
+        "VALUES ('delete', old.id, old.description); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS item_fts_update AFTER UPDATE OF description ON item BEGIN "
+        "INSERT INTO item_fts (item_fts, rowid, description) "
+        "VALUES ('delete', old.id, old.description); "
+        "INSERT INTO item_fts (rowid, description) VALUES (new.id, new.description); "
+        "END",
+        "INSERT INTO item_fts (item_fts) VALUES ('rebuild')",
+    ],
+    [  # 5: Change counter, bumped on every write to `item`.
+        'CREATE TABLE IF NOT EXISTS journal_state ('
+        'id INTEGER PRIMARY KEY CHECK (id = 1), '
+        'change_counter INTEGER NOT NULL DEFAULT 0)',
+        'INSERT OR IGNORE INTO journal_state (id, change_counter) VALUES (1, 0)',
+    ] + [
+        f'CREATE TRIGGER IF NOT EXISTS item_change_{op.lower()} AFTER {op} ON item BEGIN '
+        f'UPDATE journal_state SET change_counter = change_counter + 1; '
+        f'END'
+        for op in ('INSERT', 'UPDATE', 'DELETE')
+    ],
+    [  # 6: Change index and tombstones for incremental export.
+        'CREATE INDEX IF NOT EXISTS ix_item_time_changed '
+        'ON item (coalesce(time_updated, time_created))',
+        'CREATE TABLE IF NOT EXISTS item_tombstone ('
+        'id INTEGER PRIMARY KEY, '
+        'time_deleted DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)',
+        'CREATE INDEX IF NOT EXISTS ix_item_tombstone_time_deleted '
+        'ON item_tombstone (time_deleted)',
+        'CREATE TRIGGER IF NOT EXISTS item_tombstone_delete AFTER DELETE ON item BEGIN '
+        'INSERT OR REPLACE INTO item_tombstone (id) VALUES (old.id); '
+        'END',
+        'CREATE TRIGGER IF NOT EXISTS item_tombstone_insert AFTER INSERT ON item BEGIN '
+        'DELETE FROM item_tombstone WHERE id = new.id; '
+        'END',
+    ],
+    [  # 7: Recurring items.
+        add_column('recurrence', 'VARCHAR'),
+        add_column('recurrence_id', 'INTEGER'),
+        add_column('recurrence_time', 'DATETIME'),
+        'CREATE INDEX IF NOT EXISTS ix_item_recurring ON item (state, signifier) '
+        'WHERE recurrence IS NOT NULL',
+        'CREATE INDEX IF NOT EXISTS ix_item_recurrence_id_time '
+        'ON item (recurrence_id, recurrence_time)',
+    ],
+    [  # 8: Change log of item IDs, for pushing live updates.
+        'CREATE TABLE IF NOT EXISTS item_change_log ('
+        'seq INTEGER PRIMARY KEY, '
+        'id INTEGER NOT NULL)',
+    ] + [
+        f'CREATE TRIGGER IF NOT EXISTS item_change_log_{op.lower()} AFTER {op} ON item BEGIN '
+        f'INSERT INTO item_change_log (id) VALUES ({row}.id); '
+        f'END'
+        for op, row in (('INSERT', 'new'), ('UPDATE', 'new'), ('DELETE', 'old'))
+    ] + [
+        # Prunes the log every thousand entries, rather than on every write.
+        f'CREATE TRIGGER IF NOT EXISTS item_change_log_prune AFTER INSERT ON item_change_log '
+        f'WHEN new.seq % 1000 = 0 BEGIN '
+        f'DELETE FROM item_change_log WHERE seq <= new.seq - {CHANGE_LOG_SIZE}; '
+        f'END',
+    ],
+    [  # 9: Top-level items added interactively had the parent 'none' instead of NULL.
+        "UPDATE item SET parent_id = NULL WHERE typeof(parent_id) NOT IN ('integer', 'null')",
+    ],
+    [  # 10: Largest archived ID, so new items never reuse one.
+        add_column('max_archived_id', 'INTEGER NOT NULL DEFAULT 0', table='journal_state'),
+        read_max_archived_id,
+    ],
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def upgrade_schema(conn: sql.engine.Connection) -> None:
+    """Brings the database schema up to `SCHEMA_VERSION`."""
+
+    version = conn.execute(sql.text('PRAGMA user_version')).scalar()
+    if version == SCHEMA_VERSION:
+        return
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f'Database schema version {version} is newer '
+                           f'than this version of bojo supports')
+
+    Base.metadata.create_all(conn)
+    for migration in MIGRATIONS[version:]:
+        for statement in migration:
+            if callable(statement):
+                statement(conn)
+            else:
+                conn.execute(sql.text(statement))
+    conn.execute(sql.text(f'PRAGMA user_version = {SCHEMA_VERSION}'))
+
 
+def new_engine() -> sql.engine.Engine:
+    """Creates an engine for the journal, which sets the pragmas on connect."""
 
-def get_session() -> sql.orm.Session:
-    DBSession = sql.orm.sessionmaker(bind=engine)
-    return DBSession()
+    engine_url = f'sqlite:///{get_bojo_root() / "db.sqlite"}'
+    engine = sql.create_engine(engine_url)
+    pragmas = get_sqlite_pragmas()
+
+    @sql.event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_conn: Any, conn_record: Any) -> None:
+        cursor = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+    trace_engine(engine)
+    return engine
+
+
+@functools.lru_cache(maxsize=None)
+def get_engine() -> sql.engine.Engine:
+    """Returns the database engine, creating it on first use."""
+
+    engine = new_engine()
+    with engine.begin() as conn:
+        upgrade_schema(conn)
+    return engine
+
+
+# Items finished long ago are moved to `archive.sqlite` by `archive_items`,
+# into a table with the same schema, so everyday queries scan less.
+ArchiveItemTable = ItemTable.to_metadata(sql.MetaData(), schema='archive')
+
+# States an item can be archived in.
+FINISHED_STATES = [ItemState.COMPLETE, ItemState.IRRELEVANT, ItemState.MIGRATED]
+
+
+def get_archive_path() -> Path:
+    return get_bojo_root() / 'archive.sqlite'
+
+
+def attach_archive(conn: sql.engine.Connection) -> None:
+    """Attaches the archive to a connection as `archive`, creating its schema.
+
+    This has to run outside of a transaction.
+    """
+
+    attached = {row.name for row in conn.execute(sql.text('PRAGMA database_list'))}
+    if 'archive' not in attached:
+        conn.exec_driver_sql('ATTACH DATABASE ? AS archive', (str(get_archive_path()),))
+    ArchiveItemTable.metadata.create_all(conn)
+
+    # Archives written by older versions are missing the newer columns.
+    columns = {row.name for row in conn.execute(sql.text('PRAGMA archive.table_info(item)'))}
+    for column in ArchiveItemTable.columns:
+        if column.name not in columns:
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(sql.text(f'ALTER TABLE archive.item ADD COLUMN {column.name} {column_type}'))
+
+
+def detach_archive(conn: sql.engine.Connection) -> None:
+    conn.exec_driver_sql('DETACH DATABASE archive')
+
+
+@functools.lru_cache(maxsize=None)
+def get_archive_engine() -> sql.engine.Engine:
+    """Returns a read-only engine whose `item` table includes the archive.
+
+    Each connection attaches the archive, and creates a temporary view named
+    `item` over both tables. SQLite looks up unqualified names in the `temp`
+    schema first, so every query on the connection reads the view instead of
+    `main.item`, without changing the queries. Writes have to use the engine
+    from `get_engine`.
+    """
+
+    with get_engine().connect() as conn:
+        attach_archive(conn)
+        conn.commit()
+        detach_archive(conn)
+
+    engine = new_engine()
+    path = str(get_archive_path())
+    columns = ', '.join(column.name for column in ItemTable.columns)
+
+    @sql.event.listens_for(engine, 'connect')
+    def attach(dbapi_conn: Any, conn_record: Any) -> None:
+        cursor = dbapi_conn.cursor()
+        cursor.execute('ATTACH DATABASE ? AS archive', (path,))
+        cursor.execute(f'CREATE TEMP VIEW item AS '
+                       f'SELECT {columns} FROM main.item '
+                       f'UNION ALL SELECT {columns} FROM archive.item')
+        cursor.close()
+
+    return engine
+
+
+def archive_items(session: sql.orm.Session, older_than: datetime) -> int:
+    """Moves finished subtrees last changed before `older_than` to the archive.
+
+    A subtree is only moved whole, from its root down, when every item in it
+    is in one of `FINISHED_STATES`, is neither a recurring series nor an
+    exception to one, and hasn't changed since `older_than`. The largest
+    archived ID is recorded, so `next_item_id` never hands it out again.
+    Returns the number of items moved, leaving the transaction open for the
+    caller.
+    """
+
+    conn = session.connection()
+    attach_archive(conn)
+
+    # The driver only opens transactions implicitly for statements starting
+    # with INSERT, UPDATE or DELETE, and these start with WITH.
+    conn.exec_driver_sql('BEGIN')
+
+    settled = sql.case((sql.and_(
+        ItemTable.c.state.in_(FINISHED_STATES),
+        sql.func.coalesce(ItemTable.c.time_updated, ItemTable.c.time_created) < older_than,
+        ItemTable.c.recurrence.is_(None),
+        ItemTable.c.recurrence_id.is_(None),
+    ), 1), else_=0)
+
+    # Subtrees can't have cycles, since they start from items without parents.
+    subtree = sql.select(ItemTable.c.id.label('root'), ItemTable.c.id, settled.label('settled')) \
+        .where(ItemTable.c.parent_id.is_(None)) \
+        .where(settled == 1) \
+        .cte('subtree', recursive=True)
+    subtree = subtree.union_all(
+        sql.select(subtree.c.root, ItemTable.c.id, settled)
+        .join(subtree, ItemTable.c.parent_id == subtree.c.id))
+    roots = sql.select(subtree.c.root) \
+        .group_by(subtree.c.root) \
+        .having(sql.func.min(subtree.c.settled) == 1)
+    ids = sql.select(subtree.c.id).where(subtree.c.root.in_(roots))
+
+    # Archived items are copied before they are deleted. An ID that is
+    # already archived belongs to a different item, which mustn't be lost.
+    columns = [column.name for column in ItemTable.columns]
+    try:
+        session.execute(ArchiveItemTable.insert().from_select(
+            columns, sql.select(*ItemTable.columns).where(ItemTable.c.id.in_(ids))))
+    except sql.exc.IntegrityError:
+        raise RuntimeError('Some of these items have the same IDs as archived items')
+    max_archived_id = sql.select(sql.func.coalesce(sql.func.max(ArchiveItemTable.c.id), 0))
+    session.execute(JournalState.update().values(max_archived_id=sql.func.max(
+        JournalState.c.max_archived_id, max_archived_id.scalar_subquery())))
+
+    # Archived items still exist, so the move mustn't leave tombstones or
+    # change log entries, which would export and push them as deletions. The
+    # triggers writing them are dropped and re-created in this transaction,
+    # like in `bulk_load`; the change counter still moves.
+    triggers = session.execute(sql.text(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' "
+        "AND name IN ('item_tombstone_delete', 'item_change_log_delete')")).all()
+    for name, _ in triggers:
+        session.execute(sql.text(f'DROP TRIGGER {name}'))
+    session.execute(ItemTable.delete().where(ItemTable.c.id.in_(ids)))
+    # The driver can't count rows for statements that start with `WITH`.
+    num_items = session.execute(sql.select(sql.func.changes())).scalar()
+    for _, ddl in triggers:
+        session.execute(sql.text(ddl))
+    return num_items
+
+
+def load_subtrees(session: sql.orm.Session, roots: List[Any],
+                  show_complete: bool = True) -> Dict[int, List[ItemRecord]]:
+    """Loads every descendant of `roots` with a single recursive query.
+
+    Returns the children of each loaded item, keyed by parent ID. If
+    `show_complete` is false, completed children (and everything below them)
+    are left out.
+    """
+
+    children = defaultdict(list)
+    if not roots:
+        return children
+
+    def filter_complete(query: sql.sql.Select) -> sql.sql.Select:
+        if show_complete:
+            return query
+        return query.where(ItemTable.c.state != ItemState.COMPLETE)
+
+    root_ids = [root.id for root in roots]
+    subtree = filter_complete(
+        sql.select(ItemTable.c.id).where(ItemTable.c.parent_id.in_(root_ids))) \
+        .cte('subtree', recursive=True)
+    descendants = filter_complete(
+        sql.select(ItemTable.c.id).join(subtree, ItemTable.c.parent_id == subtree.c.id))
+    # UNION rather than UNION ALL, so a parent cycle cannot recurse forever.
+    subtree = subtree.union(descendants)
+
+    stmt = select_records() \
+        .where(ItemTable.c.id.in_(sql.select(subtree.c.id))) \
+        .order_by(ItemTable.c.id)
+    for record in fetch_records(session, stmt):
+        children[record.parent_id].append(record)
+    return children
+
+
+def select_series() -> sql.sql.Select:
+    """Selects recurring series, to expand with `merge_occurrences`."""
+
+    return select_records().where(ItemTable.c.recurrence.isnot(None))
+
+
+def merge_occurrences(session: sql.orm.Session, items: sql.sql.Select,
+                      series: sql.sql.Select, after: datetime) -> Iterator[ItemRecord]:
+    """Lazily merges stored items with occurrences of series, in time order.
+
+    `items` has to be ordered by time and leave out series. Occurrences at
+    or after `after` are records of their series, with the occurrence time
+    as `time` and `recurrence_time`; ones replaced by a stored exception are
+    skipped, since the exception is an item of its own.
+    """
+
+    series_rows = [row for row in fetch_records(session, series) if row.time is not None]
+    if not series_rows:
+        return fetch_records(session, items)
+
+    exceptions = {tuple(row) for row in session.execute(
+        sql.select(ItemTable.c.recurrence_id, ItemTable.c.recurrence_time)
+        .where(ItemTable.c.recurrence_id.in_([row.id for row in series_rows]))
+        .where(ItemTable.c.recurrence_time >= after)
+    )}
+
+    def expand(row: ItemRecord) -> Iterator[ItemRecord]:
+        for t in iter_occurrences(row.recurrence, row.time, after):
+            if (row.id, t) not in exceptions:
+                yield row._replace(time=t, recurrence_time=t)
+
+    return heapq.merge(fetch_records(session, items), *map(expand, series_rows),
+                       key=lambda row: row.time)
+
+
+def get_exception(session: sql.orm.Session, series: Item, occurrence: datetime) -> Item:
+    """Returns the stored item for an occurrence of a series, adding it if needed."""
+
+    exception = session.execute(
+        sql.select(Item)
+        .where(Item.recurrence_id == series.id)
+        .where(Item.recurrence_time == occurrence)
+    ).scalar()
+    if exception is None:
+        exception = Item(description=series.description, state=series.state,
+                         signifier=series.signifier, time=occurrence,
+                         parent_id=series.parent_id, recurrence_id=series.id,
+                         recurrence_time=occurrence)
+        exception.id = next_item_id()
+        session.add(exception)
+    return exception
+
+
+# External-content FTS5 table mirroring `item.description`, kept in sync by
+# the triggers created in the schema migrations.
+ItemFTS = sql.table('item_fts', sql.column('rowid'), sql.column('description'))
+
+
+def search_items(match: str) -> sql.sql.Select:
+    """Selects the records matching an FTS5 query, such as `foo*` or `"foo bar"`."""
+
+    return select_records() \
+        .join(ItemFTS, ItemFTS.c.rowid == ItemTable.c.id) \
+        .where(ItemFTS.c.description.match(match))
+
+
+def search_rank() -> sql.sql.ColumnElement:
+    """Returns the bm25 rank of a `search_items` row; lower is better."""
+
+    return sql.func.bm25(sql.literal_column(ItemFTS.name))
+
+
+JournalState = sql.table('journal_state', sql.column('change_counter'),
+                         sql.column('max_archived_id'))
+
+
+def next_item_id() -> sql.sql.ColumnElement:
+    """Returns the ID for a new item, above every item in the journal or archive.
+
+    SQLite's own choice is one more than the largest ID in `item`, which
+    reuses archived IDs once the newest items are gone, so every insert sets
+    its ID from this. As part of the insert, it can't race another writer.
+    """
+
+    max_id = sql.select(sql.func.coalesce(sql.func.max(ItemTable.c.id), 0)).scalar_subquery()
+    return sql.select(sql.func.max(max_id, JournalState.c.max_archived_id) + 1).scalar_subquery()
+
+
+def get_change_counter(session: sql.orm.Session) -> int:
+    """Returns a counter that increases whenever any item changes."""
+
+    return session.execute(sql.select(JournalState.c.change_counter)).scalar()
+
+
+# Logs the ID of every inserted, updated or deleted item, in order.
+ItemChangeLog = sql.table('item_change_log', sql.column('seq'), sql.column('id'))
+
+
+def get_change_position(session: sql.orm.Session) -> Tuple[int, int]:
+    """Returns the change counter and the last change log entry, read together.
+
+    Every logged change also bumps the counter, so if the two advance by
+    different amounts, some changes (like a bulk load) weren't logged.
+    """
+
+    counter = sql.select(JournalState.c.change_counter).scalar_subquery()
+    seq = sql.select(sql.func.coalesce(sql.func.max(ItemChangeLog.c.seq), 0)).scalar_subquery()
+    counter, seq = session.execute(sql.select(counter, seq)).one()
+    return counter, seq
+
+
+def get_changed_ids(session: sql.orm.Session, after_seq: int, to_seq: int) -> Optional[List[int]]:
+    """Returns the IDs of items changed by the log entries in `(after_seq, to_seq]`.
+
+    Returns None if the log has been pruned past `after_seq`.
+    """
+
+    first_seq = session.execute(sql.select(sql.func.min(ItemChangeLog.c.seq))).scalar()
+    if first_seq is None or first_seq > after_seq + 1:
+        return None
+    return session.execute(
+        sql.select(ItemChangeLog.c.id).distinct()
+        .where(ItemChangeLog.c.seq > after_seq)
+        .where(ItemChangeLog.c.seq <= to_seq)
+        .order_by(ItemChangeLog.c.id)).scalars().all()
+
+
+def get_current_time(session: sql.orm.Session) -> datetime:
+    """Returns the database clock, which stamps `time_created` and `time_updated`."""
+
+    return session.execute(sql.select(sql.func.now(type_=sql.DateTime))).scalar()
+
+
+def deleted_since(session: sql.orm.Session, since: datetime) -> List[int]:
+    return session.execute(
+        sql.select(ItemTombstone.c.id)
+        .where(at_or_after(ItemTombstone.c.time_deleted, since))
+        .order_by(ItemTombstone.c.id)).scalars().all()
+
+
+def insert_statement(merge: bool = False) -> sql.sql.Insert:
+    """Returns a bulk insert into `item`; with `merge`, an upsert by ID."""
+
+    table = Item.__table__
+    if not merge:
+        return table.insert()
+    insert = sqlite_insert(table)
+    return insert.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_={c.name: insert.excluded[c.name] for c in table.columns if c.name != 'id'})
+
+
+def insert_rows(session: sql.orm.Session, rows: Iterable[Dict[str, Any]],
+                batch_size: int = 1000, merge: bool = False, commit: bool = True) -> int:
+    """Bulk inserts column values, `batch_size` rows per statement.
+
+    With `commit`, each batch is committed as it is inserted.
+    """
+
+    insert = insert_statement(merge)
+    num_rows = 0
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        session.execute(insert, batch)
+        if commit:
+            session.commit()
+        num_rows += len(batch)
+    return num_rows
+
+
+@contextlib.contextmanager
+def bulk_load(session: sql.orm.Session) -> Iterator[None]:
+    """Suspends the per-row triggers on `item` for one large load.
+
+    The triggers are dropped and re-created inside a single transaction, so
+    other connections never see the table without them. Their work is then
+    done once for the whole load: the search index is rebuilt, the change
+    counter is bumped and tombstones of re-inserted IDs are removed. The load
+    isn't written to the change log, so live pages reload instead.
+    """
+
+    triggers = session.execute(sql.text(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'item'"
+    )).all()
+    try:
+        # The driver only opens a transaction implicitly for DML, so this has
+        # to run before the DDL for the drops to be rolled back on failure.
+        session.execute(sql.text(
+            'UPDATE journal_state SET change_counter = change_counter + 1'))
+        for name, _ in triggers:
+            session.execute(sql.text(f'DROP TRIGGER {name}'))
+        yield
+        session.execute(sql.text("INSERT INTO item_fts (item_fts) VALUES ('rebuild')"))
+        session.execute(sql.text(
+            'DELETE FROM item_tombstone WHERE id IN (SELECT id FROM item)'))
+        for _, ddl in triggers:
+            session.execute(sql.text(ddl))
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+
+
+def import_items(session: sql.orm.Session, item_dicts: Iterable[Dict[str, Any]],
+                 batch_size: int = 1000, merge: bool = False) -> int:
+    """Bulk inserts `as_dict` records, committing every `batch_size` rows.
+
+    With `merge`, existing rows with the same ID are overwritten, and
+    records like `{"id": 1, "deleted": true}` delete the item.
+    """
+
+    table = Item.__table__
+    insert = insert_statement(merge)
+    num_items = 0
+    item_dicts = iter(item_dicts)
+    while True:
+        batch = list(itertools.islice(item_dicts, batch_size))
+        if not batch:
+            break
+        deleted = [d['id'] for d in batch if d.get('deleted', False)]
+        if deleted and not merge:
+            raise RuntimeError('Deleted items can only be imported with --merge')
+        rows = [Item.row_from_dict(d) for d in batch if not d.get('deleted', False)]
+        if rows:
+            session.execute(insert, rows)
+        if deleted:
+            session.execute(table.delete().where(table.c.id.in_(deleted)))
+        session.commit()
+        num_items += len(batch)
+    return num_items
+
+
+def rebuild_search_index(session: sql.orm.Session) -> None:
+    session.execute(sql.text("INSERT INTO item_fts (item_fts) VALUES ('rebuild')"))
+    session.commit()
+
+
+def explain_query(session: sql.orm.Session, stmt: sql.sql.Select) -> List[str]:
+    """Returns the SQLite query plan for a statement, one line per step."""
+
+    conn = session.connection()
+    compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True})
+    plan = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}')
+    return [row[-1] for row in plan]
+
+
+def get_pragma(session: sql.orm.Session, name: str) -> Any:
+    return session.execute(sql.text(f'PRAGMA {name}')).scalar()
+
+
+@functools.lru_cache(maxsize=None)
+def get_sessionmaker(include_archive: bool = False) -> sql.orm.sessionmaker:
+    return sql.orm.sessionmaker(bind=get_archive_engine() if include_archive else get_engine())
+
+
+@functools.lru_cache(maxsize=None)
+def get_scoped_session() -> sql.orm.scoped_session:
+    """Returns a thread-local session registry, for use by the web server."""
+
+    return sql.orm.scoped_session(get_sessionmaker())
+
+
+def get_session(include_archive: bool = False) -> sql.orm.Session:
+    """Returns a new session; with `include_archive`, a read-only one that
+    also sees archived items."""
+
+    return get_sessionmaker(include_archive)()
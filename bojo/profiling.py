@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+import contextlib
+import heapq
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Any, ContextManager, Dict, List, NamedTuple, Optional, Tuple
+
+
+class ImportTiming(NamedTuple):
+    module: str
+    depth: int
+    self_time: float
+    cumulative_time: float
+
+
+def profile_imports(module: str = 'bojo.command_line') -> List[ImportTiming]:
+    """Imports a module in a fresh interpreter and returns per-import timings.
+
+    This uses Python's `-X importtime` flag, so the numbers reflect a cold
+    start rather than whatever happens to be cached in this process.
+    """
+
+    cmd = [sys.executable, '-X', 'importtime', '-c', f'import {module}']
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode:
+        raise RuntimeError(f'Failed to import {module}:\n{proc.stderr}')
+
+    timings = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue  # Header line.
+        stripped = name.lstrip()
+        depth = (len(name) - len(stripped) - 1) // 2
+        timings.append(ImportTiming(stripped, depth, int(self_us) / 1e6,
+                                    int(cumulative_us) / 1e6))
+    return timings
+
+
+class Tracer:
+    """Collects phase timings and SQL statement counters for one command or request."""
+
+    # Number of slowest statements kept for the summary.
+    NUM_SLOWEST = 5
+
+    def __init__(self, start_time: Optional[float] = None) -> None:
+        self.start_time = time.perf_counter() if start_time is None else start_time
+        self.phase_times: Dict[str, float] = defaultdict(float)
+        self.phase_statements: Dict[str, int] = defaultdict(int)
+        self.current_phase = 'other'
+        self.num_statements = 0
+        self.sql_time = 0.0
+        self.slowest: List[Tuple[float, str]] = []
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Any:
+        outer_phase, self.current_phase = self.current_phase, name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_times[name] += time.perf_counter() - start
+            self.current_phase = outer_phase
+
+    def add_phase_time(self, name: str, seconds: float) -> None:
+        self.phase_times[name] += seconds
+
+    def record_statement(self, statement: str, seconds: float) -> None:
+        self.num_statements += 1
+        self.sql_time += seconds
+        self.phase_statements[self.current_phase] += 1
+        # Collapses expanded `IN (?, ?, ...)` parameter lists.
+        statement = re.sub(r'\?(, \?)+', '?, ...', ' '.join(statement.split()))
+        item = (seconds, statement)
+        if len(self.slowest) < self.NUM_SLOWEST:
+            heapq.heappush(self.slowest, item)
+        else:
+            heapq.heappushpop(self.slowest, item)
+
+    def summary(self) -> Dict[str, Any]:
+        phases = {
+            name: {'ms': self.phase_times[name] * 1000,
+                   'statements': self.phase_statements[name]}
+            for name in sorted(set(self.phase_times) | set(self.phase_statements))
+        }
+        return {
+            'total_ms': (time.perf_counter() - self.start_time) * 1000,
+            'statements': self.num_statements,
+            'sql_ms': self.sql_time * 1000,
+            'phases': phases,
+            'slowest': [{'ms': seconds * 1000, 'sql': statement}
+                        for seconds, statement in sorted(self.slowest, reverse=True)],
+        }
+
+
+# The process-wide tracer, set by `enable_tracing`. Requests handled by the
+# web server use their own tracer in `local` instead.
+tracer: Optional[Tracer] = None
+local = threading.local()
+
+
+def enable_tracing(start_time: Optional[float] = None) -> Tracer:
+    global tracer
+
+    if tracer is None:
+        tracer = Tracer(start_time)
+    return tracer
+
+
+def get_tracer() -> Optional[Tracer]:
+    return getattr(local, 'tracer', None) or tracer
+
+
+def start_request_tracing() -> Tracer:
+    """Traces the current thread with a fresh tracer, for one web request."""
+
+    local.tracer = Tracer()
+    return local.tracer
+
+
+def stop_request_tracing() -> Optional[Tracer]:
+    current, local.tracer = getattr(local, 'tracer', None), None
+    return current
+
+
+class RequestMetrics:
+    """Thread-safe totals of request tracers, per endpoint."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.totals: Dict[str, List[float]] = defaultdict(lambda: [0, 0, 0.0, 0.0])
+
+    def add(self, endpoint: str, tracer: Tracer) -> None:
+        seconds = time.perf_counter() - tracer.start_time
+        with self.lock:
+            totals = self.totals[endpoint]
+            totals[0] += 1
+            totals[1] += tracer.num_statements
+            totals[2] += tracer.sql_time
+            totals[3] += seconds
+
+    def render(self) -> str:
+        """Renders the totals in the Prometheus text format."""
+
+        metrics = [
+            ('bojo_requests_total', 'counter', 'Requests handled'),
+            ('bojo_sql_statements_total', 'counter', 'SQL statements executed'),
+            ('bojo_sql_seconds_total', 'counter', 'Time spent executing SQL'),
+            ('bojo_request_seconds_total', 'counter', 'Time spent handling requests'),
+        ]
+        with self.lock:
+            totals = {endpoint: list(values) for endpoint, values in self.totals.items()}
+        lines = []
+        for i, (name, kind, help_str) in enumerate(metrics):
+            lines.append(f'# HELP {name} {help_str}')
+            lines.append(f'# TYPE {name} {kind}')
+            for endpoint, values in sorted(totals.items()):
+                lines.append(f'{name}{{endpoint="{endpoint}"}} {values[i]}')
+        return '\n'.join(lines) + '\n'
+
+
+def trace_phase(name: str) -> ContextManager:
+    """Times a phase of the current command, if tracing is enabled."""
+
+    current = get_tracer()
+    if current is None:
+        return contextlib.nullcontext()
+    return current.phase(name)
+
+
+def trace_engine(engine: Any) -> None:
+    """Counts and times every statement the engine runs while a tracer is active."""
+
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any,
+                              context: Any, executemany: bool) -> None:
+        if get_tracer() is not None:
+            conn.info.setdefault('trace_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any,
+                             context: Any, executemany: bool) -> None:
+        current = get_tracer()
+        starts = conn.info.get('trace_start')
+        if current is not None and starts:
+            current.record_statement(statement, time.perf_counter() - starts.pop())
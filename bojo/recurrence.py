@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""Recurrence rules for repeating items.
+
+A rule is either a frequency (`daily`, `weekly`, `monthly` or `yearly`) or a
+subset of the iCalendar RRULE syntax, like
+
+    FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,WE;COUNT=10;UNTIL=20261231
+
+Occurrences are computed rather than stored, starting from the item's time.
+Jumping ahead to a time window takes constant time, however far ahead it is.
+Monthly and yearly occurrences on a day that a month doesn't have (like the
+31st) fall on the last day of that month.
+"""
+
+import calendar
+import functools
+from datetime import datetime, timedelta
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+FREQUENCIES = ['DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY']
+WEEKDAYS = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+RULE_PARTS = {'FREQ', 'INTERVAL', 'COUNT', 'UNTIL', 'BYDAY'}
+
+
+class Recurrence(NamedTuple):
+    freq: str
+    interval: int = 1
+    count: Optional[int] = None
+    until: Optional[datetime] = None
+    weekdays: Tuple[int, ...] = ()
+
+
+def parse_until(s: str) -> datetime:
+    """Parses an RRULE `UNTIL` value; a date means the end of that day."""
+
+    for fmt in ('%Y%m%dT%H%M%S', '%Y%m%dT%H%M%SZ'):
+        try:
+            return datetime.strptime(s, fmt)
+        except ValueError:
+            pass
+    for parse in (lambda s: datetime.strptime(s, '%Y%m%d'), datetime.fromisoformat):
+        try:
+            t = parse(s)
+        except ValueError:
+            continue
+        if len(s) <= len('YYYY-MM-DD'):
+            t = t.replace(hour=23, minute=59, second=59)
+        return t.replace(tzinfo=None)
+    raise ValueError(f'Invalid UNTIL {s}')
+
+
+@functools.lru_cache(maxsize=256)
+def parse_recurrence(rule: str) -> Recurrence:
+    rule = rule.strip()
+    if rule.upper() in FREQUENCIES:
+        return Recurrence(rule.upper())
+
+    parts = {}
+    for part in rule.upper().split(';'):
+        key, sep, value = part.partition('=')
+        if not sep or key.strip() not in RULE_PARTS:
+            raise RuntimeError(f'Invalid recurrence {rule}. Use one of '
+                               f'{", ".join(f.lower() for f in FREQUENCIES)} '
+                               f'or an RRULE like FREQ=WEEKLY;BYDAY=MO,WE')
+        parts[key.strip()] = value.strip()
+
+    try:
+        recurrence = Recurrence(
+            freq=parts['FREQ'],
+            interval=int(parts.get('INTERVAL', 1)),
+            count=int(parts['COUNT']) if 'COUNT' in parts else None,
+            until=parse_until(parts['UNTIL']) if 'UNTIL' in parts else None,
+            weekdays=tuple(sorted({WEEKDAYS.index(d.strip())
+                                   for d in parts['BYDAY'].split(',')}))
+            if 'BYDAY' in parts else (),
+        )
+    except (KeyError, ValueError) as e:
+        raise RuntimeError(f'Invalid recurrence {rule}: {e}')
+    if recurrence.freq not in FREQUENCIES:
+        raise RuntimeError(f'Invalid frequency {recurrence.freq}')
+    if recurrence.interval < 1 or (recurrence.count is not None and recurrence.count < 1):
+        raise RuntimeError(f'Invalid recurrence {rule}: INTERVAL and COUNT must be positive')
+    if recurrence.weekdays and recurrence.freq != 'WEEKLY':
+        raise RuntimeError(f'Invalid recurrence {rule}: BYDAY is only supported for weekly rules')
+    return recurrence
+
+
+def add_months(t: datetime, months: int) -> datetime:
+    year, month = divmod(t.month - 1 + months, 12)
+    year += t.year
+    day = min(t.day, calendar.monthrange(year, month + 1)[1])
+    return t.replace(year=year, month=month + 1, day=day)
+
+
+def iter_indexed(rule: Recurrence, start: datetime,
+                 after: datetime) -> Iterator[Tuple[int, datetime]]:
+    """Yields `(index, time)` for every occurrence, from just before `after` on."""
+
+    if rule.freq == 'WEEKLY' and rule.weekdays:
+        period = timedelta(weeks=rule.interval)
+        week_start = start - timedelta(days=start.weekday())
+        first_week = [d for d in rule.weekdays if d >= start.weekday()]
+        week = max(0, (after - week_start) // period)
+        index = 0 if week == 0 else len(first_week) + (week - 1) * len(rule.weekdays)
+        while True:
+            for day in first_week if week == 0 else rule.weekdays:
+                yield index, week_start + week * period + timedelta(days=day)
+                index += 1
+            week += 1
+
+    if rule.freq in ('DAILY', 'WEEKLY'):
+        period = timedelta(days=rule.interval) if rule.freq == 'DAILY' \
+            else timedelta(weeks=rule.interval)
+        index = max(0, (after - start) // period)
+        while True:
+            yield index, start + index * period
+            index += 1
+
+    step = rule.interval * (12 if rule.freq == 'YEARLY' else 1)
+    months = (after.year - start.year) * 12 + after.month - start.month
+    index = max(0, months // step)
+    while True:
+        yield index, add_months(start, index * step)
+        index += 1
+
+
+def iter_occurrences(rule: str, start: datetime, after: datetime) -> Iterator[datetime]:
+    """Lazily yields the occurrences of `rule` at or after `after`, in order.
+
+    `start` is the first occurrence. Iteration ends at `COUNT` or `UNTIL`, so
+    rules without either never end; callers stop at the end of their window.
+    """
+
+    recurrence = parse_recurrence(rule)
+    for index, t in iter_indexed(recurrence, start, after):
+        if recurrence.count is not None and index >= recurrence.count:
+            return
+        if recurrence.until is not None and t > recurrence.until:
+            return
+        if t >= after:
+            yield t
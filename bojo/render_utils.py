@@ -1,22 +1,40 @@
 #!/usr/bin/env python
 
-from typing import List, Optional, Union
+import itertools
+import json
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 import click
+import sqlalchemy as sql
 from termcolor import colored
 
+from bojo.config import should_use_verbose
 from bojo.db import (
-    get_session,
+    fetch_records,
+    load_subtrees,
+    CLOCK_FORMAT,
+    DATE_FORMAT,
     Item,
     ItemState,
+    ItemStateColor,
     ItemStateDict,
+    ItemStateDictInv,
     ItemSignifier,
     ItemSignifierDict,
+    ItemSignifierDictInv,
 )
+from bojo.profiling import trace_phase
 
 NONE_STR = 'none'
 ALL_STR = 'all'
 
+# Column order for tab-separated rows passed to `bojo add --batch`.
+BATCH_FIELDS = ['description', 'state', 'signifier', 'parent', 'time']
+
+# Number of rows rendered per round trip in `render_items`.
+RENDER_BATCH_SIZE = 500
+
 ALL_CHOICES = [s for s in ItemStateDict.keys()] + \
               [s for s in ItemSignifierDict.keys()] + \
               [s.value for s in ItemState] + \
@@ -28,15 +46,134 @@ def render_title(s: str) -> None:
     click.echo(colored(s, attrs=['underline']) + ':')
 
 
-def render_items(items: List[Item], title: str, empty_str: Optional[str], **kwargs) -> None:
-    num_items = items.count()
-    if num_items:
-        render_title(title)
-        for item in items:
-            click.echo(item.render(**kwargs))
+def color_wrap(**kwargs) -> Tuple[str, str]:
+    """Returns the escape codes `colored` puts before and after its text.
+
+    Computed per render, so the terminal checks in `colored` still apply.
+    """
+
+    before, after = colored('\0', **kwargs).split('\0')
+    return before, after
+
+
+class TimeFormatter:
+    """Formats times like `Item.TIME_FORMAT`, caching the date and clock parts.
+
+    Listings repeat the same days and minutes many times, so this runs
+    `strftime` once per distinct day and clock time rather than once per row.
+    """
+
+    def __init__(self) -> None:
+        self.dates: Dict[Any, str] = {}
+        self.clocks: Dict[Tuple[int, int], str] = {}
+
+    def __call__(self, t: datetime) -> str:
+        date = self.dates.get(t.date())
+        if date is None:
+            date = self.dates[t.date()] = t.strftime(DATE_FORMAT)
+        clock = self.clocks.get((t.hour, t.minute))
+        if clock is None:
+            clock = self.clocks[(t.hour, t.minute)] = t.strftime(CLOCK_FORMAT)
+        return f'{date} at {clock}'
+
+
+def iter_tree(roots: Iterable[Any], get_children: Callable[[Any], Iterable[Any]],
+              show_complete_children: bool = True) -> Iterator[Tuple[int, Any]]:
+    """Walks item trees depth-first, yielding `(depth, row)` pairs."""
+
+    stack = [(0, root) for root in reversed(list(roots))]
+    while stack:
+        depth, row = stack.pop()
+        yield depth, row
+        children = [child for child in get_children(row)
+                    if show_complete_children or child.state != ItemState.COMPLETE]
+        stack.extend((depth + 1, child) for child in reversed(children))
+
+
+def render_rows(rows: Iterable[Tuple[int, Any]], verbose_mode: Optional[bool] = None) -> List[str]:
+    """Renders `(depth, row)` pairs into lines, like `Item.render`.
+
+    Rows only need `id`, `description`, `state`, `signifier` and `time`
+    attributes. The escape codes for each state and signifier are worked out
+    once up front instead of per row.
+    """
+
+    if verbose_mode is None:
+        verbose_mode = should_use_verbose()
+
+    id_before, id_after = color_wrap(attrs=['underline'])
+    time_before, time_after = color_wrap(attrs=['dark'])
+    bold_before, bold_after = color_wrap(attrs=['bold'])
+    format_time = TimeFormatter()
+
+    # Maps (state, signifier) to the text around the description.
+    wraps = {}
+    for state in ItemState:
+        color_before, color_after = color_wrap(color=ItemStateColor[state])
+        state_symbol = ItemStateDictInv[state]
+        if verbose_mode:
+            state_symbol = f'{state_symbol} ({state.value})'
+        for signifier in [None, *ItemSignifier]:
+            before = f'{state_symbol} {color_before}'
+            after = color_after
+            if signifier is not None:
+                signifier_symbol = ItemSignifierDictInv[signifier]
+                if verbose_mode:
+                    signifier_symbol = f'{signifier_symbol} ({signifier.value})'
+                before = f'{signifier_symbol} {before}'
+                if signifier == ItemSignifier.PRIORITY:
+                    before, after = bold_before + before, after + bold_after
+            wraps[state, signifier] = (before, after)
+
+    lines = []
+    for depth, row in rows:
+        before, after = wraps[row.state, row.signifier]
+        line = f'{before}{row.description}{after}'
+        if row.time is not None:
+            line = f'{line} {time_before}{format_time(row.time)}{time_after}'
+        if row.id is not None:
+            line = f'{id_before}{row.id}{id_after} {line}'
+        if depth:
+            indent = '  ' * depth
+            line = indent + line.replace('\n', '\n' + indent)
+        lines.append(line)
+    return lines
+
+
+def render_items(session: sql.orm.Session, items: Union[sql.sql.Select, Iterable[Any]],
+                 title: str, empty_str: Optional[str], **kwargs) -> None:
+    """Renders the records selected by a statement, running it only once.
+
+    Rows are streamed in batches; the subtrees for each batch are loaded
+    together, and each batch is written with a single `click.echo`. `items`
+    can also be an iterable of records, like merged occurrences.
+    """
+
+    render_opts = Item.RenderOpts(**kwargs)
+    if isinstance(items, sql.sql.Select):
+        rows = fetch_records(session, items, RENDER_BATCH_SIZE)
     else:
-        if empty_str is not None:
-            click.echo(empty_str)
+        rows = iter(items)
+    num_items = 0
+    while True:
+        batch = list(itertools.islice(rows, RENDER_BATCH_SIZE))
+        if not batch:
+            break
+        children = {}
+        if render_opts.show_children:
+            children = load_subtrees(session, batch, render_opts.show_complete_children)
+        if not num_items:
+            render_title(title)
+        num_items += len(batch)
+        tree = iter_tree(batch, lambda row: children.get(row.id, []),
+                         render_opts.show_complete_children)
+        with trace_phase('render'):
+            lines = '\n'.join(render_rows(tree, kwargs.get('verbose_mode')))
+        with trace_phase('output'):
+            click.echo(lines)
+
+    if not num_items and empty_str is not None:
+        click.echo(empty_str)
 
 
 def parse_state(state: str) -> ItemState:
@@ -96,3 +233,58 @@ def parse_choice(s: str) -> Optional[Union[ItemState, ItemSignifier]]:
 
     opts = ', '.join(ALL_CHOICES)
     raise ValueError(f'Invalid choice: {s}. Options are {opts}')
+
+
+def parse_id_ranges(s: str) -> List[Tuple[int, int]]:
+    """Parses IDs and inclusive ranges like `12-40,55,60`."""
+
+    ranges = []
+    for part in s.split(','):
+        low, _, high = part.strip().partition('-')
+        try:
+            low_id = int(low)
+            high_id = int(high) if high else low_id
+        except ValueError:
+            raise RuntimeError(f'Invalid ID range {part.strip()}')
+        if high_id < low_id:
+            raise RuntimeError(f'Invalid ID range {part.strip()}')
+        ranges.append((low_id, high_id))
+    return ranges
+
+
+def parse_batch_line(line: str) -> Dict[str, str]:
+    """Parses one `add --batch` row, either a JSON object or tab-separated.
+
+    Fields follow the options of `bojo add`; missing optional fields default
+    to `none`.
+    """
+
+    if line.lstrip().startswith('{'):
+        values = json.loads(line)
+        unknown = set(values) - set(BATCH_FIELDS)
+        if unknown:
+            raise RuntimeError(f'Unknown fields: {", ".join(sorted(unknown))}')
+    else:
+        columns = line.split('\t')
+        if len(columns) > len(BATCH_FIELDS):
+            raise RuntimeError(f'Expected at most {len(BATCH_FIELDS)} columns')
+        values = dict(zip(BATCH_FIELDS, columns))
+
+    row = {k: NONE_STR for k in BATCH_FIELDS}
+    row.update({k: str(v) for k, v in values.items() if v is not None and v != ''})
+    if row['description'] == NONE_STR or row['state'] == NONE_STR:
+        raise RuntimeError('Description and state are required')
+    return row
+
+
+def parse_timestamp(s: str) -> datetime:
+    """Parses an ISO 8601 timestamp or one formatted like `Item.as_dict`."""
+
+    try:
+        return datetime.fromisoformat(s)
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(s, Item.TIME_FORMAT)
+    except ValueError:
+        raise RuntimeError(f'Invalid timestamp {s}')
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""Compact columnar snapshots of the item table.
+
+A snapshot is a fixed header followed by one block per column:
+
+    header: magic (8s), format version (B), compression (B), number of
+            columns (H), number of rows (Q)
+    block:  column name (16s), raw size (Q), stored size (Q), then the
+            stored (possibly compressed) bytes
+
+Integer columns are little-endian arrays. Times are microseconds since
+1970-01-01 in the journal's local time, with `NULL_INT` for missing values,
+so nothing is lost to string formatting. Descriptions and recurrence rules
+are each one UTF-8 heap plus an offsets array, with an empty rule for none.
+The `meta` block is JSON naming the enum codes. Readers ignore blocks they
+don't know, and treat missing optional columns as empty.
+"""
+
+import array
+import json
+import lzma
+import mmap
+import struct
+import sys
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, BinaryIO, Dict, Iterator, Union
+
+import sqlalchemy as sql
+
+from bojo.db import Item, ItemSignifier, ItemState
+
+MAGIC = b'BOJOSNAP'
+VERSION = 1
+HEADER = struct.Struct('<8sBBHQ')
+BLOCK = struct.Struct('<16sQQ')
+
+COMPRESSIONS = ['none', 'zlib', 'lzma']
+COMPRESSORS = {
+    'none': (lambda b: b, lambda b: b),
+    'zlib': (zlib.compress, zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+NULL_INT = -2 ** 63
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+INT_COLUMNS = ['id', 'parent_id', 'recurrence_id']
+TIME_COLUMNS = ['time', 'time_created', 'time_updated', 'recurrence_time']
+
+# Columns added after the first version, which older snapshots don't have.
+OPTIONAL_COLUMNS = ['recurrence_id', 'recurrence_time']
+
+REQUIRED_BLOCKS = ['meta', 'state', 'signifier', 'desc_offsets', 'desc_heap'] + [
+    name for name in INT_COLUMNS + TIME_COLUMNS if name not in OPTIONAL_COLUMNS]
+
+
+def to_bytes(values: array.array) -> bytes:
+    if sys.byteorder != 'little':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def from_bytes(typecode: str, data: Union[bytes, memoryview]) -> array.array:
+    values = array.array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def write_snapshot(session: sql.orm.Session, f: BinaryIO,
+                   compression: str = 'zlib', batch_size: int = 10000) -> int:
+    """Writes every item to `f` and returns the number of rows written."""
+
+    states, signifiers = list(ItemState), list(ItemSignifier)
+    state_codes = {s: i for i, s in enumerate(states)}
+    signifier_codes = {s: i + 1 for i, s in enumerate(signifiers)}
+
+    ints = {name: array.array('q') for name in INT_COLUMNS + TIME_COLUMNS}
+    state_col, signifier_col = array.array('B'), array.array('B')
+    offsets, heap = array.array('Q', [0]), bytearray()
+    rule_offsets, rule_heap = array.array('Q', [0]), bytearray()
+
+    table = Item.__table__
+    rows = session.execute(
+        sql.select(table).order_by(table.c.id).execution_options(yield_per=batch_size))
+    for row in rows:
+        ints['id'].append(row.id)
+        ints['parent_id'].append(NULL_INT if row.parent_id is None else row.parent_id)
+        ints['recurrence_id'].append(NULL_INT if row.recurrence_id is None else row.recurrence_id)
+        for name in TIME_COLUMNS:
+            t = getattr(row, name)
+            ints[name].append(NULL_INT if t is None else (t - EPOCH) // MICROSECOND)
+        state_col.append(state_codes[row.state])
+        signifier_col.append(signifier_codes.get(row.signifier, 0))
+        heap += row.description.encode('utf-8')
+        offsets.append(len(heap))
+        rule_heap += (row.recurrence or '').encode('utf-8')
+        rule_offsets.append(len(rule_heap))
+
+    meta = {
+        'states': [s.value for s in states],
+        'signifiers': [s.value for s in signifiers],
+    }
+    blocks = {
+        'meta': json.dumps(meta).encode('utf-8'),
+        'state': state_col.tobytes(),
+        'signifier': signifier_col.tobytes(),
+        'desc_offsets': to_bytes(offsets),
+        'desc_heap': bytes(heap),
+        'rule_offsets': to_bytes(rule_offsets),
+        'rule_heap': bytes(rule_heap),
+    }
+    blocks.update({name: to_bytes(values) for name, values in ints.items()})
+
+    compress, _ = COMPRESSORS[compression]
+    num_rows = len(state_col)
+    f.write(HEADER.pack(MAGIC, VERSION, COMPRESSIONS.index(compression),
+                        len(blocks), num_rows))
+    for name, raw in blocks.items():
+        stored = compress(raw)
+        f.write(BLOCK.pack(name.encode('ascii'), len(raw), len(stored)))
+        f.write(stored)
+    return num_rows
+
+
+def release_blocks(blocks: Dict[str, Union[bytes, memoryview]]) -> None:
+    for block in blocks.values():
+        if isinstance(block, memoryview):
+            block.release()
+
+
+def read_blocks(view: memoryview) -> Dict[str, Union[bytes, memoryview]]:
+    """Splits a snapshot into its blocks, which may be slices of `view`.
+
+    The caller has to release the slices with `release_blocks`, since a
+    memory map can't be closed while they exist.
+    """
+
+    if len(view) < HEADER.size:
+        raise RuntimeError('Snapshot is truncated or corrupt')
+    magic, version, compression, num_blocks, _ = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise RuntimeError('Not a bojo snapshot')
+    if version != VERSION:
+        raise RuntimeError(f'Unsupported snapshot version {version}')
+    if compression >= len(COMPRESSIONS):
+        raise RuntimeError('Snapshot is truncated or corrupt')
+    _, decompress = COMPRESSORS[COMPRESSIONS[compression]]
+
+    blocks: Dict[str, Union[bytes, memoryview]] = {}
+    pos = HEADER.size
+    try:
+        for _ in range(num_blocks):
+            if pos + BLOCK.size > len(view):
+                raise RuntimeError('Snapshot is truncated or corrupt')
+            name, raw_size, stored_size = BLOCK.unpack_from(view, pos)
+            pos += BLOCK.size
+            if pos + stored_size > len(view) or (compression == 0 and stored_size != raw_size):
+                raise RuntimeError('Snapshot is truncated or corrupt')
+            stored = view[pos:pos + stored_size]
+            pos += stored_size
+            if compression == 0:
+                block: Union[bytes, memoryview] = stored
+            else:
+                with stored:
+                    try:
+                        block = decompress(stored)
+                    except (lzma.LZMAError, zlib.error):
+                        raise RuntimeError('Snapshot is truncated or corrupt')
+                if len(block) != raw_size:
+                    raise RuntimeError('Snapshot is truncated or corrupt')
+            blocks[name.rstrip(b'\0').decode('ascii', 'replace')] = block
+        if any(name not in blocks for name in REQUIRED_BLOCKS):
+            raise RuntimeError('Snapshot is truncated or corrupt')
+    except BaseException:
+        release_blocks(blocks)
+        raise
+    return blocks
+
+
+def iter_snapshot_rows(data: Union[bytes, mmap.mmap]) -> Iterator[Dict[str, Any]]:
+    """Yields column values for each row, ready for a bulk insert.
+
+    Closing the iterator releases its views of `data`.
+    """
+
+    with memoryview(data) as view:
+        blocks = read_blocks(view)
+        try:
+            yield from iter_block_rows(blocks)
+        finally:
+            release_blocks(blocks)
+
+
+def iter_block_rows(blocks: Dict[str, Union[bytes, memoryview]]) -> Iterator[Dict[str, Any]]:
+    meta = json.loads(bytes(blocks['meta']))
+    states = [ItemState(s) for s in meta['states']]
+    signifiers = [None] + [ItemSignifier(s) for s in meta['signifiers']]
+
+    num_rows = len(blocks['state'])
+    for name in OPTIONAL_COLUMNS:
+        if name not in blocks:
+            blocks[name] = to_bytes(array.array('q', [NULL_INT] * num_rows))
+    if 'rule_offsets' not in blocks:
+        blocks['rule_offsets'] = to_bytes(array.array('Q', [0] * (num_rows + 1)))
+        blocks['rule_heap'] = b''
+
+    ints = {name: from_bytes('q', blocks[name]) for name in INT_COLUMNS + TIME_COLUMNS}
+    state_col, signifier_col = blocks['state'], blocks['signifier']
+    offsets, heap = from_bytes('Q', blocks['desc_offsets']), blocks['desc_heap']
+    rule_offsets, rule_heap = from_bytes('Q', blocks['rule_offsets']), blocks['rule_heap']
+
+    def to_time(v: int) -> Any:
+        return None if v == NULL_INT else EPOCH + v * MICROSECOND
+
+    for i, id in enumerate(ints['id']):
+        parent_id = ints['parent_id'][i]
+        recurrence_id = ints['recurrence_id'][i]
+        yield {
+            'id': id,
+            'description': str(heap[offsets[i]:offsets[i + 1]], 'utf-8'),
+            'state': states[state_col[i]],
+            'signifier': signifiers[signifier_col[i]],
+            'time': to_time(ints['time'][i]),
+            'time_created': to_time(ints['time_created'][i]),
+            'time_updated': to_time(ints['time_updated'][i]),
+            'parent_id': None if parent_id == NULL_INT else parent_id,
+            'recurrence': str(rule_heap[rule_offsets[i]:rule_offsets[i + 1]], 'utf-8') or None,
+            'recurrence_id': None if recurrence_id == NULL_INT else recurrence_id,
+            'recurrence_time': to_time(ints['recurrence_time'][i]),
+        }
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional
+
+import click
+import sqlalchemy as sql
+
+from bojo.config import get_bojo_root
+from bojo.db import (
+    get_engine,
+    get_scoped_session,
+    get_session,
+    get_sessionmaker,
+    insert_rows,
+    ItemState,
+    ItemSignifier,
+)
+
+# Rough shape of a real journal, used by `generate_items`.
+STATE_WEIGHTS = {
+    ItemState.INCOMPLETE: 30,
+    ItemState.COMPLETE: 35,
+    ItemState.MIGRATED: 8,
+    ItemState.SCHEDULED: 5,
+    ItemState.IRRELEVANT: 4,
+    ItemState.NOTE: 10,
+    ItemState.EVENT: 8,
+}
+SIGNIFIER_WEIGHTS = {
+    None: 85,
+    ItemSignifier.PRIORITY: 10,
+    ItemSignifier.INSPIRATION: 5,
+}
+WORDS = [
+    'call', 'email', 'review', 'write', 'plan', 'meeting', 'project', 'report',
+    'groceries', 'dentist', 'budget', 'draft', 'book', 'trip', 'idea', 'notes',
+    'team', 'weekly', 'read', 'fix', 'garden', 'gym', 'taxes', 'birthday',
+]
+
+
+def generate_items(num_items: int, seed: int = 0,
+                   now: Optional[datetime] = None) -> Iterator[Dict[str, Any]]:
+    """Generates column values for a synthetic journal.
+
+    Roughly 60% of items are top-level; the rest hang off one of the
+    preceding 200 items, which produces trees several levels deep. Items are
+    created over the past year and about 60% have a time, spread from a year
+    ago to three months ahead.
+    """
+
+    rng = random.Random(seed)
+    now = now or datetime.now()
+    states, state_weights = zip(*STATE_WEIGHTS.items())
+    signifiers, signifier_weights = zip(*SIGNIFIER_WEIGHTS.items())
+
+    for id in range(1, num_items + 1):
+        state = rng.choices(states, state_weights)[0]
+        created = now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+        time = None
+        if rng.random() < 0.6:
+            time = now + timedelta(minutes=rng.randint(-365 * 24 * 60, 90 * 24 * 60))
+        parent_id = None
+        if id > 1 and rng.random() < 0.4:
+            parent_id = rng.randint(max(1, id - 200), id - 1)
+        yield {
+            'id': id,
+            'description': ' '.join(rng.choices(WORDS, k=rng.randint(2, 6))),
+            'state': state,
+            'signifier': rng.choices(signifiers, signifier_weights)[0],
+            'time': time,
+            'time_created': created,
+            'time_updated': None if state == ItemState.INCOMPLETE else created,
+            'parent_id': parent_id,
+        }
+
+
+def use_root(root: Optional[str]) -> None:
+    """Points bojo at another data directory, or the default one if `None`."""
+
+    if root is None:
+        os.environ.pop('BOJO_ROOT', None)
+    else:
+        os.environ['BOJO_ROOT'] = root
+    get_scoped_session.cache_clear()
+    get_sessionmaker.cache_clear()
+    if get_engine.cache_info().currsize:
+        get_engine().dispose()
+    get_engine.cache_clear()
+    get_bojo_root.cache_clear()
+
+
+def time_call(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+    }
+
+
+@click.command('bench', help='Benchmark commands against a synthetic journal')
+@click.option('-n', '--num-items', type=int, default=10000, help='Number of items to generate')
+@click.option('-r', '--repeat', type=int, default=3, help='Number of runs per benchmark')
+@click.option('--seed', type=int, default=0, help='Seed for the data generator')
+@click.option('-o', '--output', default='-', help='File to write the JSON results to')
+def bench_command(num_items: int, repeat: int, seed: int, output: str) -> None:
+    from click.testing import CliRunner
+
+    from bojo.command_line import cli
+    from bojo.subcommands.serve import create_app
+
+    old_root = os.environ.get('BOJO_ROOT')
+    runner = CliRunner()
+
+    def invoke(*args: str, input: Optional[str] = None) -> Callable[[], None]:
+        def run() -> None:
+            result = runner.invoke(cli, list(args), input=input)
+            if result.exception is not None and not isinstance(result.exception, SystemExit):
+                raise result.exception
+        return run
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        use_root(str(tmp_dir / 'journal'))
+        try:
+            results = {}
+            start = time.perf_counter()
+            insert_rows(get_session(), generate_items(num_items, seed), batch_size=10000)
+            results['generate'] = {'min': time.perf_counter() - start}
+
+            export_file = str(tmp_dir / 'export.jsonl')
+            batch_file = tmp_dir / 'batch.tsv'
+            batch_file.write_text(''.join(f'bench item {i}\t.\tnone\tnone\tnone\n'
+                                          for i in range(100)))
+            client = create_app().test_client()
+
+            benchmarks = {
+                'list all': invoke('list', '-n', '50', 'all'),
+                'list upcoming': invoke('list', '-n', '50', 'upcoming'),
+                'list pri': invoke('list', '-n', '50', 'pri'),
+                'list complete': invoke('list', '-n', '50', 'complete'),
+                'query': invoke('query', 'meeting'),
+                'query full-text': invoke('query', '-f', 'meet*'),
+                'complete': invoke('complete', input='n\n'),
+                'export jsonl': invoke('export', '-f', 'jsonl', export_file),
+                'import jsonl merge': invoke('import', '-f', 'jsonl', '-m', export_file),
+                'add': invoke('add', '-d', 'bench item', '-s', '.', '--signifier', 'none',
+                              '-p', 'none', '-t', 'none', input='y\n'),
+                'add batch': invoke('add', '--batch', str(batch_file)),
+                'serve index': lambda: client.get(f'/{ItemState.INCOMPLETE.value}'),
+            }
+            for name, fn in benchmarks.items():
+                results[name] = time_call(fn, repeat)
+        finally:
+            use_root(old_root)
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'num_items': num_items,
+        'repeat': repeat,
+        'seed': seed,
+        'python': platform.python_version(),
+        'sqlalchemy': sql.__version__,
+        'sqlite': sqlite3.sqlite_version,
+        'results': results,
+    }
+    with click.open_file(output, 'w') as f:
+        json.dump(report, f, indent=2)
+        f.write('\n')
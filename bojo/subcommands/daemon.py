@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+import contextlib
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import time
+import traceback
+from typing import Any, Dict, Iterator, List, Optional
+
+import click
+
+import bojo
+from bojo import profiling
+from bojo.config import get_daemon_socket
+
+# Commands the daemon runs. The rest either always prompt, or serve or
+# change the process, so the client runs them itself.
+DAEMON_COMMANDS = {'info', 'list', 'mark', 'query'}
+
+
+class NeedsTerminal(Exception):
+    """Raised when a command run by the daemon tries to prompt."""
+
+
+def needs_terminal(*args: Any) -> str:
+    raise NeedsTerminal()
+
+
+class ForwardedStream(io.TextIOBase):
+    """Sends complete lines of output to the client as JSON messages.
+
+    A trailing partial line is held back until the command finishes, so a
+    prompt that has to fall back to the client leaves no output behind.
+    """
+
+    encoding = 'utf-8'
+
+    def __init__(self, f: Any, name: str, isatty: bool) -> None:
+        self.f = f
+        self.name = name
+        self.is_tty = isatty
+        self.pending = ''
+        self.sent = False
+
+    def isatty(self) -> bool:
+        return self.is_tty
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        self.pending += text
+        lines, sep, self.pending = self.pending.rpartition('\n')
+        if sep:
+            self.send(lines + sep)
+        return len(text)
+
+    def send(self, text: str) -> None:
+        message = {'stream': self.name, 'text': text}
+        self.f.write(json.dumps(message).encode('utf-8') + b'\n')
+        self.f.flush()
+        self.sent = True
+
+    def close_command(self) -> None:
+        if self.pending:
+            self.send(self.pending)
+            self.pending = ''
+
+
+def get_command(argv: List[str]) -> Optional[str]:
+    """Returns the subcommand name, skipping the group's flags."""
+
+    return next((arg for arg in argv if not arg.startswith('-')), None)
+
+
+@contextlib.contextmanager
+def client_context(request: Dict[str, Any], out: ForwardedStream,
+                   err: ForwardedStream) -> Iterator[None]:
+    """Runs a command as if it were in the client's process."""
+
+    old_env, old_cwd = dict(os.environ), os.getcwd()
+    old_streams = sys.stdin, sys.stdout, sys.stderr
+    old_prompts = click.termui.visible_prompt_func, click.termui.hidden_prompt_func
+    os.environ.clear()
+    os.environ.update(request['env'])
+    os.chdir(request['cwd'])
+    sys.stdin, sys.stdout, sys.stderr = io.StringIO(), out, err
+    click.termui.visible_prompt_func = click.termui.hidden_prompt_func = needs_terminal
+
+    # Whether to use colors is cached per process, but depends on the client.
+    from termcolor import termcolor
+    if hasattr(termcolor, 'can_colorize'):
+        termcolor.can_colorize.cache_clear()
+
+    # Traces start with the request, not with the daemon.
+    bojo.START_TIME = time.perf_counter()
+    profiling.tracer = None
+
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(old_env)
+        os.chdir(old_cwd)
+        sys.stdin, sys.stdout, sys.stderr = old_streams
+        click.termui.visible_prompt_func, click.termui.hidden_prompt_func = old_prompts
+        profiling.tracer = None
+
+
+def run_command(argv: List[str]) -> int:
+    from bojo.command_line import cli
+
+    try:
+        cli.main(args=argv, prog_name='bojo')
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        click.echo(e.code, err=True)
+        return 1
+    return 0
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        request = json.loads(self.rfile.readline())
+        argv = request['argv']
+        if get_command(argv) not in DAEMON_COMMANDS:
+            self.reply({'fallback': True})
+            return
+
+        out = ForwardedStream(self.wfile, 'out', request['isatty'][0])
+        err = ForwardedStream(self.wfile, 'err', request['isatty'][1])
+        try:
+            with client_context(request, out, err):
+                try:
+                    exit_code = run_command(argv)
+                except NeedsTerminal:
+                    if not (out.sent or err.sent):
+                        self.reply({'fallback': True})
+                        return
+                    err.write('\nThis command needs a terminal; set BOJO_NO_DAEMON=1\n')
+                    exit_code = 1
+                except Exception:
+                    traceback.print_exc()
+                    exit_code = 1
+                out.close_command()
+                err.close_command()
+            self.reply({'exit': exit_code})
+        except BrokenPipeError:
+            # The client went away, like on Ctrl-C.
+            pass
+
+    def reply(self, message: Dict[str, Any]) -> None:
+        self.wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+
+def is_running(path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def warm_up() -> None:
+    """Does the slow setup up front, so the first command is fast too."""
+
+    import dateparser
+
+    from bojo.db import get_engine
+
+    get_engine()
+    dateparser.parse('tomorrow')
+
+
+@click.command('daemon', help='Keeps bojo loaded to run commands faster')
+def daemon_command() -> None:
+    path = str(get_daemon_socket())
+    if is_running(path):
+        raise click.ClickException(f'A daemon is already listening on {path}')
+    if os.path.exists(path):
+        os.unlink(path)
+
+    warm_up()
+
+    # Commands run one at a time, since they change the process state.
+    old_umask = os.umask(0o077)
+    try:
+        server = socketserver.UnixStreamServer(path, RequestHandler)
+    finally:
+        os.umask(old_umask)
+    click.echo(f'Listening on {path}', err=True)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+import os
+
+import click
+import sqlalchemy as sql
+
+from bojo.config import get_bojo_root, get_sqlite_pragmas
+from bojo.db import (
+    explain_query,
+    get_pragma,
+    get_session,
+    rebuild_search_index,
+    Item,
+    ItemState,
+    ItemSignifier,
+)
+from bojo.render_utils import render_title
+from bojo.subcommands.list import (
+    all_query,
+    complete_query,
+    overdue_query,
+    pri_query,
+    series_query,
+    upcoming_query,
+)
+
+
+@click.group('db')
+def db_command() -> None:
+    """Inspects and maintains the database."""
+
+    pass
+
+
+@db_command.command(help='Check that list queries are served by indexes')
+def explain() -> None:
+    session = get_session()
+
+    # The unfiltered `list all` walks the table in ID order and stops at the
+    # item limit, so it is the one listing that is allowed to scan.
+    queries = {
+        'list all incomplete': all_query(ItemState.INCOMPLETE),
+        'list all priority': all_query(ItemSignifier.PRIORITY),
+        'list upcoming': upcoming_query(None),
+        'list upcoming event': upcoming_query(ItemState.EVENT),
+        'list upcoming priority': upcoming_query(ItemSignifier.PRIORITY),
+        'list upcoming (recurring)': series_query(ItemState.EVENT),
+        'list pri': pri_query(),
+        'list complete': complete_query(),
+        'complete': overdue_query(),
+    }
+
+    num_scans = 0
+    for name, query in queries.items():
+        render_title(name)
+        for step in explain_query(session, query):
+            click.echo(f'  {step}')
+            if step.startswith('SCAN'):
+                num_scans += 1
+
+    if num_scans:
+        raise click.ClickException(f'{num_scans} queries fell back to a table scan')
+    click.echo('All queries use an index')
+
+
+@db_command.command('rebuild-index', help='Rebuild the full-text search index')
+def rebuild_index() -> None:
+    rebuild_search_index(get_session())
+    click.echo('Rebuilt search index')
+
+
+def render_stats(session: sql.orm.Session) -> None:
+    render_title('Settings')
+    for name in get_sqlite_pragmas():
+        click.echo(f'  {name}: {get_pragma(session, name)}')
+
+    render_title('Database')
+    db_path = get_bojo_root() / 'db.sqlite'
+    click.echo(f'  path: {db_path}')
+    click.echo(f'  size: {os.path.getsize(db_path)} bytes')
+    click.echo(f'  schema version: {get_pragma(session, "user_version")}')
+    click.echo(f'  page size: {get_pragma(session, "page_size")}')
+    click.echo(f'  pages: {get_pragma(session, "page_count")}')
+    click.echo(f'  free pages: {get_pragma(session, "freelist_count")}')
+    click.echo(f'  items: {session.query(Item).count()}')
+
+
+@db_command.command(help='Show active connection settings and database size')
+def stats() -> None:
+    render_stats(get_session())
+
+
+@db_command.command(help='Refresh query planner statistics and compact the database')
+@click.option('--vacuum', is_flag=True, help='Also rebuild the file to reclaim free pages')
+def tune(vacuum: bool) -> None:
+    session = get_session()
+    session.execute(sql.text('ANALYZE'))
+    session.execute(sql.text('PRAGMA optimize'))
+    session.commit()
+    if vacuum:
+        session.execute(sql.text('VACUUM'))
+    render_stats(session)
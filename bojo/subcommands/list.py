@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
-from typing import Optional
+import itertools
+from typing import Optional, Union
 
 import click
 import sqlalchemy as sql
@@ -8,7 +9,10 @@ from datetime import datetime
 
 from bojo.db import (
     get_session,
-    Item,
+    merge_occurrences,
+    select_records,
+    select_series,
+    ItemTable,
     ItemState,
     ItemStateDict,
     ItemSignifier,
@@ -20,16 +24,68 @@ from bojo.render_utils import (
     NONE_STR,
 )
 
+Choice = Optional[Union[ItemState, ItemSignifier]]
+
+
+def all_query(state: Choice) -> sql.sql.Select:
+    items = select_records().order_by(ItemTable.c.id.desc())
+    if isinstance(state, ItemState):
+        items = items.where(ItemTable.c.state == state)
+    elif isinstance(state, ItemSignifier):
+        items = items.where(ItemTable.c.signifier == state)
+    return items
+
+
+def upcoming_query(state: Choice) -> sql.sql.Select:
+    items = select_records() \
+        .where(ItemTable.c.time > datetime.now()) \
+        .where(ItemTable.c.recurrence.is_(None))
+    if isinstance(state, ItemState):
+        items = items.where(ItemTable.c.state == state)
+    elif isinstance(state, ItemSignifier):
+        items = items.where(ItemTable.c.signifier == state)
+    return items.order_by(ItemTable.c.time)
+
+
+def series_query(state: Choice) -> sql.sql.Select:
+    items = select_series()
+    if isinstance(state, ItemState):
+        items = items.where(ItemTable.c.state == state)
+    elif isinstance(state, ItemSignifier):
+        items = items.where(ItemTable.c.signifier == state)
+    return items
+
+
+def pri_query() -> sql.sql.Select:
+    return select_records() \
+        .where(ItemTable.c.signifier == ItemSignifier.PRIORITY) \
+        .order_by(ItemTable.c.time)
+
+
+def complete_query() -> sql.sql.Select:
+    return select_records() \
+        .where(ItemTable.c.state == ItemState.COMPLETE) \
+        .order_by(ItemTable.c.time_updated.desc())
+
+
+def overdue_query() -> sql.sql.Select:
+    return select_records() \
+        .where(ItemTable.c.time < datetime.now()) \
+        .where(ItemTable.c.state != ItemState.COMPLETE) \
+        .where(ItemTable.c.recurrence.is_(None))
+
 
 @click.group('list', invoke_without_command=True)
 @click.option('-n', '--num-items', envvar='BOJO_NUM_ITEMS',
               type=int, default=10, prompt='Number of items')
+@click.option('-a', '--include-archive', is_flag=True, help='Also list archived items')
 @click.pass_context
-def list_command(ctx, num_items: int) -> None:
+def list_command(ctx, num_items: int, include_archive: bool) -> None:
     """Lists items in the bullet journal."""
 
     ctx.ensure_object(dict)
     ctx.obj['NUM_ITEMS'] = num_items
+    ctx.obj['INCLUDE_ARCHIVE'] = include_archive
 
     if ctx.invoked_subcommand is None:
         ctx.invoke(pri)
@@ -39,68 +95,56 @@ def list_command(ctx, num_items: int) -> None:
 @click.argument('state', type=str, default=NONE_STR)
 @click.pass_context
 def all(ctx, state: str) -> None:
-    session = get_session()
+    session = get_session(ctx.obj['INCLUDE_ARCHIVE'])
     num_items = ctx.obj['NUM_ITEMS']
 
-    items = session.query(Item).order_by(Item.id.desc())
     state = parse_choice(state)
-    if isinstance(state, ItemState):
-        items = items.filter(Item.state == state)
-        strs = (f'All {state.value}', f'No {state.value}')
-    elif isinstance(state, ItemSignifier):
-        items = items.filter(Item.signifier == state)
-        strs = (f'All {state.value}', f'No {state.value}')
-    else:
+    items = all_query(state).limit(num_items)
+    if state is None:
         strs = ('All items', 'No items')
-    items = items.limit(num_items)
+    else:
+        strs = (f'All {state.value}', f'No {state.value}')
 
-    render_items(items, *strs, show_children=False)
+    render_items(session, items, *strs, show_children=False)
 
 
 @list_command.command(help='Show upcoming items')
 @click.argument('state', type=str, default=ItemState.EVENT.value)
 @click.pass_context
 def upcoming(ctx, state: str) -> None:
-    session = get_session()
+    session = get_session(ctx.obj['INCLUDE_ARCHIVE'])
     num_items = ctx.obj['NUM_ITEMS']
 
-    items = session.query(Item).filter(Item.time > datetime.now())
+    # Recurring items are expanded lazily, so only `num_items` occurrences
+    # are generated however far ahead they are.
     state = parse_choice(state)
-    if isinstance(state, ItemState):
-        items = items.filter(Item.state == state)
-        strs = (f'Upcoming {state.value}', f'No upcoming {state.value}')
-    elif isinstance(state, ItemSignifier):
-        items = items.filter(Item.signifier == state)
-        strs = (f'Upcoming {state.value}', f'No upcoming {state.value}')
-    else:
+    items = merge_occurrences(session, upcoming_query(state).limit(num_items),
+                              series_query(state), datetime.now())
+    items = itertools.islice(items, num_items)
+    if state is None:
         strs = ('Upcoming items', 'No upcoming items')
-    items = items.order_by(Item.time).limit(num_items)
+    else:
+        strs = (f'Upcoming {state.value}', f'No upcoming {state.value}')
 
-    render_items(items, *strs)
+    render_items(session, items, *strs)
 
 
 @list_command.command(help='Show priority items')
 @click.pass_context
 def pri(ctx) -> None:
-    session = get_session()
+    session = get_session(ctx.obj['INCLUDE_ARCHIVE'])
     num_items = ctx.obj['NUM_ITEMS']
 
-    items = session.query(Item) \
-        .filter(Item.signifier == ItemSignifier.PRIORITY) \
-        .order_by(Item.time) \
-        .limit(num_items)
-    render_items(items, 'Priority items', 'No priority items',
+    items = pri_query().limit(num_items)
+    render_items(session, items, 'Priority items', 'No priority items',
                  show_complete_children=False)
 
 
 @list_command.command(help='Show completed items')
 @click.pass_context
 def complete(ctx) -> None:
-    session = get_session()
+    session = get_session(ctx.obj['INCLUDE_ARCHIVE'])
     num_items = ctx.obj['NUM_ITEMS']
 
-    items = session.query(Item) \
-        .filter(Item.state == ItemState.COMPLETE) \
-        .order_by(Item.time_updated.desc()) \
-        .limit(num_items)
-    render_items(items, 'Completed Items', 'All past items are completed')
+    items = complete_query().limit(num_items)
+    render_items(session, items, 'Completed Items', 'All past items are completed')
@@ -1,56 +1,516 @@
 #!/usr/bin/env python
 
+import collections
+import contextlib
+import functools
+import itertools
+import json
+import logging
 import pathlib
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
 
 import click
 
 from bojo.db import (
+    changed_since,
+    get_change_counter,
+    get_change_position,
+    get_changed_ids,
     get_session,
-    Item,
+    fetch_records,
+    get_record,
+    get_scoped_session,
+    merge_occurrences,
+    select_records,
+    select_series,
+    ItemTable,
     ItemState,
     ItemStateDict,
     ItemSignifier,
     ItemSignifierDict,
 )
+from bojo.profiling import (
+    get_tracer,
+    start_request_tracing,
+    stop_request_tracing,
+    RequestMetrics,
+)
 from bojo.render_utils import (
     parse_choice,
+    parse_signifier,
+    parse_state,
+    parse_timestamp,
     ALL_CHOICES,
     NONE_STR,
 )
 
+# Number of rendered pages kept in memory by each server process.
+PAGE_CACHE_SIZE = 128
 
-@click.command('serve', help='Serves bullet journal through Flask')
-@click.option('-p', '--port', type=int, default=8000)
-def serve_command(port: int) -> None:
-    from flask import Flask, render_template
+# Number of rows fetched per round trip when streaming API responses.
+API_BATCH_SIZE = 500
+
+# Window of upcoming items returned when neither `end` nor `limit` is given,
+# since recurring items would otherwise repeat forever.
+DEFAULT_UPCOMING_WINDOW = timedelta(days=365)
+
+# Most items pushed in one change event; pages reload for larger changes.
+MAX_EVENT_ITEMS = 200
+
+# Number of change events kept for event streams that fall behind.
+EVENT_HISTORY_SIZE = 64
+
+# Seconds between keep-alive comments on an idle event stream.
+KEEP_ALIVE_INTERVAL = 15.0
+
+# Seconds an event stream stays open before the browser reconnects, which
+# frees its server thread now and then.
+EVENT_STREAM_DURATION = 300.0
+
+# Seconds between requests from pages that poll for changes, because every
+# event stream was taken when they connected.
+EVENT_POLL_INTERVAL = 5.0
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeWatcher:
+    """Checks the journal for changes on one thread, for every event stream.
+
+    Each check is a single query for the change counter, and only runs while
+    a stream is open or pages are polling. At most `max_streams` streams are
+    open at once, since each holds a server thread. When the counter moves, the changed items are loaded
+    once from the change log and handed to every stream as one event, like
+
+        {"counter": 12, "items": [...], "deleted": [4]}
+
+    or `{"counter": 12, "reload": true}` if the change log can't say what
+    changed, or too much changed to push.
+    """
+
+    def __init__(self, interval: float, max_streams: int) -> None:
+        self.interval = interval
+        self.max_streams = max_streams
+        self.condition = threading.Condition()
+        self.events: Deque[Dict[str, Any]] = collections.deque(maxlen=EVENT_HISTORY_SIZE)
+        self.counter = 0
+        self.num_streams = 0
+        self.last_poll = float('-inf')
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        with self.condition:
+            if self.thread is not None:
+                return
+            session = get_session()
+            try:
+                position = get_change_position(session)
+            finally:
+                session.close()
+            self.counter = position[0]
+            self.thread = threading.Thread(target=self.run, args=(position,),
+                                           name='bojo-watcher', daemon=True)
+            self.thread.start()
+
+    def run(self, position: Tuple[int, int]) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self.condition:
+                polling = time.monotonic() - self.last_poll < 2 * EVENT_POLL_INTERVAL
+                if not self.num_streams and not polling:
+                    continue
+            session = get_session()
+            try:
+                event, position = self.check(session, position)
+            except Exception:
+                # Keeps watching; the next check picks up from the same position.
+                logger.exception('Failed to check for changes')
+                continue
+            finally:
+                session.close()
+            if event is not None:
+                with self.condition:
+                    self.events.append(event)
+                    self.counter = event['counter']
+                    self.condition.notify_all()
+
+    def check(self, session: Any, position: Tuple[int, int]
+              ) -> Tuple[Optional[Dict[str, Any]], Tuple[int, int]]:
+        """Returns the event for the changes since `position`, and the new position."""
+
+        (old_counter, old_seq), (counter, seq) = position, get_change_position(session)
+        if counter == old_counter:
+            return None, position
+        event: Dict[str, Any] = {'since': old_counter, 'counter': counter}
+
+        ids = None
+        if counter - old_counter == seq - old_seq:
+            ids = get_changed_ids(session, old_seq, seq)
+        if ids is None or len(ids) > MAX_EVENT_ITEMS:
+            event['reload'] = True
+            return event, (counter, seq)
+
+        items = list(fetch_records(session, select_records().where(ItemTable.c.id.in_(ids))))
+        found = {item.id for item in items}
+        event['items'] = [item.as_dict() for item in items]
+        event['deleted'] = [id for id in ids if id not in found]
+        return event, (counter, seq)
+
+    def wait(self, counter: int, timeout: float) -> List[Dict[str, Any]]:
+        """Waits for the events after `counter`; returns none on timeout."""
+
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.counter > counter, timeout):
+                return []
+            # Streams from before the oldest event kept can't be caught up.
+            if not self.events or self.events[0]['since'] > counter:
+                return [{'since': counter, 'counter': self.counter, 'reload': True}]
+            return [event for event in self.events if event['counter'] > counter]
+
+    @contextlib.contextmanager
+    def open_stream(self) -> Iterator[bool]:
+        """Takes a stream; yields False, and counts a poll, if all are taken."""
+
+        with self.condition:
+            opened = self.num_streams < self.max_streams
+            if opened:
+                self.num_streams += 1
+            else:
+                self.last_poll = time.monotonic()
+        try:
+            yield opened
+        finally:
+            if opened:
+                with self.condition:
+                    self.num_streams -= 1
+
+
+def create_app(page_size: int = 50, poll_interval: float = 1.0, max_streams: int = 3) -> Any:
+    """Creates the Flask app; the database is only opened by requests."""
+
+    from flask import (
+        abort,
+        Flask,
+        jsonify,
+        make_response,
+        render_template,
+        request,
+        Response,
+        stream_with_context,
+        url_for,
+    )
 
     cur_folder = str(pathlib.Path(__file__).parent.absolute())
     app = Flask(__name__, template_folder=cur_folder)
 
+    metrics = RequestMetrics()
+    watcher = ChangeWatcher(poll_interval, max_streams)
+
+    @app.teardown_appcontext
+    def remove_session(exception: Optional[BaseException]) -> None:
+        get_scoped_session().remove()
+
+    @app.before_request
+    def start_trace() -> None:
+        start_request_tracing()
+
+    @app.after_request
+    def add_trace_header(response: Any) -> Any:
+        tracer = get_tracer()
+        if tracer is None:
+            return response
+
+        # Streamed responses are still running here, so their header only
+        # covers the work done before the body. The metrics are updated when
+        # the response is closed, after any streaming has finished.
+        summary = tracer.summary()
+        response.headers['X-Bojo-Trace'] = (f'statements={summary["statements"]}; '
+                                            f'sql_ms={summary["sql_ms"]:.2f}; '
+                                            f'total_ms={summary["total_ms"]:.2f}')
+        endpoint = request.endpoint or 'unknown'
+
+        def record_trace() -> None:
+            stop_request_tracing()
+            metrics.add(endpoint, tracer)
+
+        response.call_on_close(record_trace)
+        return response
+
+    @app.route('/metrics')
+    def metrics_page() -> Any:
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
     @app.route('/favicon.ico')
     def favicon() -> str:
         return ''
 
-    @app.route('/')
-    @app.route('/<state>')
-    def index(state: str = ItemState.MIGRATED.value) -> str:
-        session = get_session()
-        items = session.query(Item).order_by(Item.id.desc())
-        state = parse_choice(state)
-        if isinstance(state, ItemState):
-            items = items.filter(Item.state == state)
-            strs = (f'All {state.value.capitalize()}',
-                    f'No {state.value.capitalize()}')
-        elif isinstance(state, ItemSignifier):
-            items = items.filter(Item.signifier == state)
-            strs = (f'All {state.value.capitalize()}',
-                    f'No {state.value.capitalize()}')
+    @functools.lru_cache(maxsize=PAGE_CACHE_SIZE)
+    def render_page(state: str, before: Optional[int], change_counter: int) -> str:
+        # The change counter is only part of the cache key; a page rendered
+        # for an older counter is never looked up again.
+        session = get_scoped_session()
+        items = select_records().order_by(ItemTable.c.id.desc())
+        choice = parse_choice(state)
+
+        # Tells the page which pushed items belong on it.
+        live: Dict[str, Any] = {'counter': change_counter, 'first_page': before is None}
+        if isinstance(choice, ItemState):
+            items = items.where(ItemTable.c.state == choice)
+            strs = (f'All {choice.value.capitalize()}',
+                    f'No {choice.value.capitalize()}')
+            live['state'] = choice.value
+        elif isinstance(choice, ItemSignifier):
+            items = items.where(ItemTable.c.signifier == choice)
+            strs = (f'All {choice.value.capitalize()}',
+                    f'No {choice.value.capitalize()}')
+            live['signifier'] = choice.value
         else:
             strs = ('All Items', 'No Items')
-        title = strs[0] if items.count() else strs[1]
+
+        # Keyset pagination on the ID, so deep pages cost the same as the first.
+        if before is not None:
+            items = items.where(ItemTable.c.id < before)
+        items = list(fetch_records(session, items.limit(page_size + 1)))
+        next_url = None
+        if len(items) > page_size:
+            items = items[:page_size]
+            next_url = url_for('index', state=state, before=items[-1].id)
+
+        live['last_page'] = next_url is None
+        title = strs[0] if items else strs[1]
         links = [l for l in ALL_CHOICES if len(l) > 3]
-        session.close()
 
-        return render_template('index.html', items=items, title=title, links=links)
+        return render_template('index.html', items=items, title=title, links=links,
+                               next_url=next_url, live=live)
+
+    @app.route('/')
+    @app.route('/<state>')
+    def index(state: str = ItemState.MIGRATED.value) -> Any:
+        change_counter = get_change_counter(get_scoped_session())
+        etag = str(change_counter)
+        if etag in request.if_none_match:
+            response = make_response('', 304)
+        else:
+            before = request.args.get('before', type=int)
+            response = make_response(render_page(state, before, change_counter))
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    @app.route('/events')
+    def events() -> Any:
+        """Streams changes to items as Server-Sent Events.
+
+        Each event's data is a `ChangeWatcher` event, and its ID is the change
+        counter after it, so reconnecting browsers pick up where they left off.
+        If every stream is taken, this sends the events waiting so far and
+        closes, and the browser polls by reconnecting every few seconds.
+
+        Query parameters:
+            counter: Send the changes after this change counter first, like
+                the one a page was rendered at.
+        """
+
+        watcher.start()
+        counter = request.headers.get('Last-Event-ID', type=int)
+        if counter is None:
+            counter = request.args.get('counter', type=int, default=watcher.counter)
+
+        def generate(counter: int) -> Iterator[str]:
+            deadline = time.monotonic() + EVENT_STREAM_DURATION
+            with watcher.open_stream() as opened:
+                retry = poll_interval if opened else max(poll_interval, EVENT_POLL_INTERVAL)
+                yield f'retry: {int(retry * 1000)}\n\n'
+                while True:
+                    remaining = deadline - time.monotonic() if opened else 0
+                    events = watcher.wait(counter, min(remaining, KEEP_ALIVE_INTERVAL))
+                    if not events and remaining <= 0:
+                        break
+                    if not events:
+                        # Writing is the only way to notice a closed connection.
+                        yield ': keep-alive\n\n'
+                    for event in events:
+                        counter = event['counter']
+                        yield f'id: {counter}\nevent: change\ndata: {json.dumps(event)}\n\n'
+
+        response = Response(generate(counter), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    def filter_choices(items: Any) -> Any:
+        if 'state' in request.args:
+            items = items.where(ItemTable.c.state == parse_state(request.args['state']))
+        if 'signifier' in request.args:
+            signifier = parse_signifier(request.args['signifier'])
+            items = items.where(ItemTable.c.signifier == signifier)
+        return items
+
+    @app.route('/api/items')
+    def api_items() -> Any:
+        """Streams matching items as JSON Lines, in ID order.
+
+        Query parameters:
+            state, signifier: Only return items with this state or signifier.
+            start, end: Only return items scheduled in [start, end).
+            since: Only return items created or updated at or after this time.
+            after_id: Cursor; only return items with a larger ID. Pass the ID
+                of the last item received to fetch the next page.
+            limit: Maximum number of items to return.
+        """
+
+        session = get_scoped_session()
+        etag = str(get_change_counter(session))
+        if etag in request.if_none_match:
+            response = make_response('', 304)
+            response.set_etag(etag)
+            return response
+
+        args = request.args
+        items = select_records().order_by(ItemTable.c.id)
+        try:
+            items = filter_choices(items)
+            if 'start' in args:
+                items = items.where(ItemTable.c.time >= parse_timestamp(args['start']))
+            if 'end' in args:
+                items = items.where(ItemTable.c.time < parse_timestamp(args['end']))
+            if 'since' in args:
+                items = items.where(changed_since(parse_timestamp(args['since'])))
+        except RuntimeError as e:
+            abort(400, str(e))
+        if 'after_id' in args:
+            items = items.where(ItemTable.c.id > args.get('after_id', type=int, default=0))
+        if 'limit' in args:
+            items = items.limit(args.get('limit', type=int))
+
+        def generate() -> Iterator[str]:
+            for item in fetch_records(session, items, API_BATCH_SIZE):
+                yield json.dumps(item.as_dict()) + '\n'
+
+        response = Response(stream_with_context(generate()),
+                            mimetype='application/x-ndjson')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    @app.route('/api/upcoming')
+    def api_upcoming() -> Any:
+        """Streams items in a time window as JSON Lines, in time order.
 
-    app.run(port=port)
+        Recurring items are expanded into one item per occurrence, with the
+        occurrence time as `recurrence_time`.
+
+        Query parameters:
+            start, end: The window [start, end); `start` defaults to now. If
+                neither `end` nor `limit` is given, `end` defaults to a year
+                after `start`.
+            state, signifier: Only return items with this state or signifier.
+            limit: Maximum number of items to return.
+        """
+
+        session = get_scoped_session()
+        etag = str(get_change_counter(session))
+        if etag in request.if_none_match:
+            response = make_response('', 304)
+            response.set_etag(etag)
+            return response
+
+        args = request.args
+        try:
+            start = parse_timestamp(args['start']) if 'start' in args else datetime.now()
+            end = parse_timestamp(args['end']) if 'end' in args else None
+            items = filter_choices(select_records()) \
+                .where(ItemTable.c.time >= start) \
+                .where(ItemTable.c.recurrence.is_(None)) \
+                .order_by(ItemTable.c.time)
+            series = filter_choices(select_series())
+        except RuntimeError as e:
+            abort(400, str(e))
+        limit = args.get('limit', type=int)
+        if limit is not None:
+            items = items.limit(limit)
+        elif end is None:
+            end = start + DEFAULT_UPCOMING_WINDOW
+        if end is not None:
+            items = items.where(ItemTable.c.time < end)
+
+        def generate() -> Iterator[str]:
+            rows = merge_occurrences(session, items, series, start)
+            if end is not None:
+                rows = itertools.takewhile(lambda row: row.time < end, rows)
+            for item in itertools.islice(rows, limit):
+                yield json.dumps(item.as_dict()) + '\n'
+
+        response = Response(stream_with_context(generate()),
+                            mimetype='application/x-ndjson')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    @app.route('/api/items/<int:id>')
+    def api_item(id: int) -> Any:
+        item = get_record(get_scoped_session(), id)
+        if item is None:
+            abort(404)
+        return jsonify(item.as_dict())
+
+    return app
+
+
+def run_server(app: Any, host: str, port: int, workers: int, threads: int) -> None:
+    """Runs the app under Gunicorn if it is installed, otherwise Waitress.
+
+    If neither is available, this falls back to the threaded Werkzeug server
+    that ships with Flask.
+    """
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        pass
+    else:
+        class GunicornApplication(BaseApplication):
+            def load_config(self) -> None:
+                self.cfg.set('bind', f'{host}:{port}')
+                self.cfg.set('workers', workers)
+                self.cfg.set('threads', threads)
+
+            def load(self) -> Any:
+                return app
+
+        GunicornApplication().run()
+        return
+
+    if workers > 1:
+        click.echo('Gunicorn is not installed; serving from a single process', err=True)
+
+    try:
+        import waitress
+    except ImportError:
+        from werkzeug.serving import run_simple
+
+        run_simple(host, port, app, threaded=threads > 1)
+    else:
+        waitress.serve(app, host=host, port=port, threads=threads)
+
+
+@click.command('serve', help='Serves bullet journal through Flask')
+@click.option('-h', '--host', default='127.0.0.1')
+@click.option('-p', '--port', type=int, default=8000)
+@click.option('-w', '--workers', type=int, default=1, help='Number of worker processes')
+@click.option('-t', '--threads', type=int, default=4, help='Number of threads per worker')
+@click.option('--max-streams', type=click.IntRange(min=0),
+              help='Most open pages pushed changes per worker, each holding a thread; the '
+                   'rest poll. Defaults to one less than --threads')
+@click.option('--page-size', type=int, default=50, help='Number of items per page')
+@click.option('--poll-interval', type=float, default=1.0,
+              help='Seconds between checks for changes to push to open pages')
+def serve_command(host: str, port: int, workers: int, threads: int, max_streams: Optional[int],
+                  page_size: int, poll_interval: float) -> None:
+    if max_streams is None:
+        max_streams = max(threads - 1, 0)
+    app = create_app(page_size, poll_interval, max_streams)
+    run_server(app, host, port, workers, threads)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""Parses the common time phrases without loading `dateparser`.
+
+Most times given to bojo are ISO dates, clock times or a few English
+relatives, like
+
+    2026-10-20, 2026-10-20 14:00, 9:30, 9am, tomorrow 9am, next friday at noon,
+    in 3 days
+
+Each phrase is compiled once into a `TimeSpec`, which is resolved against the
+current time on every use, so cached phrases stay right across midnight.
+Anything else goes to `dateparser`, which is only imported when needed.
+Phrases `dateparser` also understands resolve to the same times; unlike it,
+"next <weekday>" is supported, meaning the first such day after today.
+"""
+
+import functools
+import re
+from datetime import date, datetime, time, timedelta
+from typing import NamedTuple, Optional
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+RELATIVE_DAYS = {'yesterday': -1, 'today': 0, 'tomorrow': 1}
+UNITS = {'minute': 'minutes', 'hour': 'hours', 'day': 'days', 'week': 'weeks'}
+
+DAY_RE = re.compile(r'(?P<iso>\d{4}-\d{2}-\d{2})'
+                    r'|(?P<relative>yesterday|today|tomorrow)'
+                    rf'|next (?P<weekday>{"|".join(WEEKDAYS)})')
+CLOCK_RE = re.compile(r'(?P<hour12>\d{1,2})(?::(?P<minute12>\d{2}))? ?(?P<meridiem>am|pm)'
+                      r'|(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?'
+                      r'|(?P<named>noon|midnight)')
+OFFSET_RE = re.compile(rf'in (?P<count>\d+) (?P<unit>{"|".join(UNITS)})s?')
+
+
+class TimeSpec(NamedTuple):
+    """A compiled time phrase, resolved by `resolve`.
+
+    The date is `day` if set, otherwise today moved by `days`, or to the next
+    `weekday`. The time is `clock` if set, otherwise midnight for `day` and
+    `weekday`, and the current time for the rest.
+    """
+
+    day: Optional[date] = None
+    days: int = 0
+    weekday: Optional[int] = None
+    clock: Optional[time] = None
+    offset: timedelta = timedelta()
+
+
+def resolve(spec: TimeSpec, now: datetime) -> datetime:
+    if spec.day is not None:
+        t = datetime.combine(spec.day, time())
+    elif spec.weekday is not None:
+        days = (spec.weekday - now.weekday() - 1) % 7 + 1
+        t = datetime.combine(now.date() + timedelta(days=days), time())
+    else:
+        t = now + timedelta(days=spec.days)
+    if spec.clock is not None:
+        t = datetime.combine(t.date(), spec.clock)
+    return t + spec.offset
+
+
+def parse_clock(s: str) -> Optional[time]:
+    """Parses a clock time like `9am`, `9:30 pm`, `21:15` or `noon`."""
+
+    match = CLOCK_RE.fullmatch(s)
+    if match is None:
+        return None
+    if match['named'] is not None:
+        return time(12) if match['named'] == 'noon' else time(0)
+    if match['meridiem'] is not None:
+        hour = int(match['hour12'])
+        if not 1 <= hour <= 12:
+            raise ValueError(f'Invalid hour {hour}')
+        hour = hour % 12 + (12 if match['meridiem'] == 'pm' else 0)
+        return time(hour, int(match['minute12'] or 0))
+    return time(int(match['hour']), int(match['minute']), int(match['second'] or 0))
+
+
+def parse_day(match: 're.Match[str]', clock: Optional[time]) -> TimeSpec:
+    if match['iso'] is not None:
+        return TimeSpec(day=date.fromisoformat(match['iso']), clock=clock)
+    if match['weekday'] is not None:
+        return TimeSpec(weekday=WEEKDAYS.index(match['weekday']), clock=clock)
+    return TimeSpec(days=RELATIVE_DAYS[match['relative']], clock=clock)
+
+
+def compile_clock_phrase(phrase: str) -> Optional[TimeSpec]:
+    """Compiles `[day] [at] [clock]` or `clock relative-day` phrases."""
+
+    # A clock alone, or after "at", is today.
+    clock = parse_clock(phrase[len('at '):] if phrase.startswith('at ') else phrase)
+    if clock is not None:
+        return TimeSpec(clock=clock)
+
+    match = DAY_RE.match(phrase)
+    if match is not None:
+        rest = phrase[match.end():]
+        if not rest:
+            return parse_day(match, None)
+        for sep in (' at ', ' ', 't' if match['iso'] else None):
+            if sep and rest.startswith(sep):
+                clock = parse_clock(rest[len(sep):])
+                if clock is not None:
+                    return parse_day(match, clock)
+        return None
+
+    clock_str, _, day_str = phrase.rpartition(' ')
+    match = DAY_RE.fullmatch(day_str)
+    clock = parse_clock(clock_str)
+    if match is not None and match['relative'] and clock is not None:
+        return parse_day(match, clock)
+    return None
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_phrase(phrase: str) -> Optional[TimeSpec]:
+    """Compiles a common time phrase; returns None for anything else."""
+
+    phrase = ' '.join(phrase.lower().split())
+    if phrase == 'now':
+        return TimeSpec()
+
+    match = OFFSET_RE.fullmatch(phrase)
+    if match is not None:
+        unit = UNITS[match['unit']]
+        return TimeSpec(offset=timedelta(**{unit: int(match['count'])}))
+
+    try:
+        return compile_clock_phrase(phrase)
+    except ValueError:
+        # Leaves invalid dates and times for `dateparser` to reject.
+        return None
+
+
+def parse_phrase(phrase: str) -> Optional[datetime]:
+    """Parses a time phrase; returns None if it can't be parsed."""
+
+    spec = compile_phrase(phrase)
+    if spec is None:
+        import dateparser
+
+        return dateparser.parse(phrase)
+    return resolve(spec, datetime.now())
@@ -22,11 +22,11 @@ setup(name='BoJo',
       packages=find_packages(),
       url='https://www.github.com/codekansas/bojo',
       entry_points={
-          'console_scripts': ['bojo=bojo.command_line:cli'],
+          'console_scripts': ['bojo=bojo.client:main'],
       },
       install_requires=[
-          'click',
+          'click>=8.0',
           'dateparser',
-          'sqlalchemy',
+          'sqlalchemy>=1.4',
           'termcolor',
       ])